@@ -0,0 +1,79 @@
+"""
+compare CPU inference engines for one model on this machine
+
+    python benchmarks/bench_backends.py --path helmet_detection_yolov8_latest_v3.pt --frames 200
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs.backends import BACKENDS, load_model
+
+
+def load_frames(source, count, size):
+    if source is None:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8) for _ in range(count)]
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, '*.jpg')) + glob.glob(os.path.join(source, '*.png')))
+        frames = [cv2.resize(cv2.imread(path), size) for path in paths[:count]]
+    else:
+        capture = cv2.VideoCapture(source)
+        frames = []
+        while len(frames) < count:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            frames.append(cv2.resize(frame, size))
+    if not frames:
+        raise SystemExit(f"No frames found in {source}")
+    return [frames[i % len(frames)] for i in range(count)]
+
+
+def run(model, frames, batch, warmup, **kwargs):
+    for i in range(warmup):
+        model.predict(frames[:batch], batch=batch, verbose=False, **kwargs)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(frames) - batch + 1, batch):
+        t0 = time.perf_counter()
+        model.predict(frames[i:i + batch], batch=batch, verbose=False, **kwargs)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000.0
+    return {
+        "fps": len(latencies) * batch / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU backend benchmark")
+    parser.add_argument("--path", required=True, help="Path to the .pt model")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma separated engines to compare")
+    parser.add_argument("--source", default=None, help="Video file or image folder, random frames if omitted")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--imgsz", type=int, default=640)
+    options = parser.parse_args()
+
+    frames = load_frames(options.source, options.frames, (640, 480))
+    report = {"batch": options.batch, "frames": len(frames), "imgsz": options.imgsz, "results": {}}
+    for backend in options.backends.split(","):
+        model = load_model(options.path, backend, imgsz=options.imgsz)
+        report["results"][backend] = run(model, frames, options.batch, options.warmup, imgsz=options.imgsz)
+        print(f"{backend:<10} {report['results'][backend]}", file=sys.stderr)
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+micro-benchmark for the ingest wire formats: old quadratic concat + pickle,
+pickle read with recv_into, the binary framed protocol, and JPEG payloads
+decoded at full and at reduced scale
+
+    python benchmarks/bench_framing.py --frames 300 --width 1920 --height 1080
+"""
+import argparse
+import os
+import pickle
+import socket
+import struct
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs.framing import (ENCODING_JPEG, LegacyPickleReader, FrameReader, decode_image, encode_image,
+                          pack_header, send_frame, send_legacy_frame)
+
+
+def concat_receive(conn, frames):
+    # the original tcp_frame_receiver loop, kept here as the baseline
+    data = b""
+    payload_size = struct.calcsize("Q")
+    for _ in range(frames):
+        while len(data) < payload_size:
+            data += conn.recv(4096)
+        msg_size = struct.unpack("Q", data[:payload_size])[0]
+        data = data[payload_size:]
+        while len(data) < msg_size:
+            data += conn.recv(4096)
+        frame_data = data[:msg_size]
+        data = data[msg_size:]
+        camera_name, frame = pickle.loads(frame_data)
+
+
+def reader_receive(reader_cls):
+    def receive(conn, frames):
+        reader = reader_cls(conn)
+        for _ in range(frames):
+            reader.read()
+    return receive
+
+
+def decode_receive(target=None):
+    def receive(conn, frames):
+        reader = FrameReader(conn)
+        for _ in range(frames):
+            decode_image(reader.read(), target)
+    return receive
+
+
+def compressed_send(image, encoding):
+    # encoded once up front, the camera pays for compression, not the node
+    payload = encode_image(image, encoding)
+
+    def send(conn, frame, seq):
+        conn.sendall(pack_header("bench", frame, seq, None, 0, encoding, payload.nbytes, frame.shape))
+        conn.sendall(payload.data)
+    return send, payload.nbytes
+
+
+def run(name, receive, send, image, frames, nbytes=None):
+    server, client = socket.socketpair()
+
+    def sender():
+        for seq in range(frames):
+            send(client, image, seq)
+        client.shutdown(socket.SHUT_WR)
+
+    thread = threading.Thread(target=sender, daemon=True)
+    start_wall = time.perf_counter()
+    start_cpu = time.thread_time()
+    thread.start()
+    receive(server, frames)
+    cpu = time.thread_time() - start_cpu
+    wall = time.perf_counter() - start_wall
+    thread.join()
+    server.close()
+    client.close()
+
+    total_bytes = frames * (image.nbytes if nbytes is None else nbytes)
+    return {
+        "path": name,
+        "MB/s": total_bytes / wall / 1e6,
+        "fps": frames / wall,
+        "recv_cpu_ms_per_frame": cpu / frames * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest wire format micro-benchmark")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--imgsz", type=int, default=640, help="Model input size the reduced decode aims for")
+    options = parser.parse_args()
+
+    image = np.random.randint(0, 255, (options.height, options.width, 3), dtype=np.uint8)
+    # smoothed so the JPEG is closer in size to a camera frame than to noise
+    jpeg_send, jpeg_bytes = compressed_send(cv2.GaussianBlur(image, (15, 15), 0), ENCODING_JPEG)
+    legacy_send = lambda conn, frame, seq: send_legacy_frame(conn, "bench", frame)
+    binary_send = lambda conn, frame, seq: send_frame(conn, "bench", frame, seq)
+
+    results = [
+        run("pickle-concat", concat_receive, legacy_send, image, options.frames),
+        run("pickle-recv_into", reader_receive(LegacyPickleReader), legacy_send, image, options.frames),
+        run("binary", reader_receive(FrameReader), binary_send, image, options.frames),
+        run("jpeg", decode_receive(), jpeg_send, image, options.frames, jpeg_bytes),
+        run("jpeg-reduced", decode_receive(options.imgsz), jpeg_send, image, options.frames, jpeg_bytes),
+    ]
+    print(f"{options.frames} frames of {options.width}x{options.height} ({image.nbytes} bytes, {jpeg_bytes} as JPEG)")
+    for result in results:
+        print("{path:<18} {MB/s:>10.1f} MB/s {fps:>9.1f} fps {recv_cpu_ms_per_frame:>8.3f} ms cpu/frame".format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+synthetic camera load generator and end-to-end benchmark
+
+simulates N cameras sending timestamped frames to the ingest port, then
+measures ingest-to-result latency through /inference/<camera>?since= and
+ingest-to-display latency through /video_feed/<camera>; prints a JSON report
+
+    python benchmarks/loadgen.py --cameras 8 --fps 10 --duration 60 --output run.json
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from libs.framing import ENCODING_JPEG, ENCODING_PNG, ENCODING_RAW, FLAG_CREDIT, CreditWindow, send_frame, send_legacy_frame
+
+ENCODINGS = {'raw': ENCODING_RAW, 'jpeg': ENCODING_JPEG, 'png': ENCODING_PNG}
+
+
+def load_frames(options):
+    size = (options.width, options.height)
+    if options.video:
+        capture = cv2.VideoCapture(options.video)
+        frames = []
+        while len(frames) < options.max_video_frames:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            frames.append(cv2.resize(frame, size))
+        if not frames:
+            raise SystemExit(f"Could not read frames from {options.video}")
+        return frames
+    # moving block over noise so motion gating and trackers see changing content
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (options.height, options.width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(30):
+        frame = background.copy()
+        x = int(i / 30 * (options.width - options.width // 8))
+        cv2.rectangle(frame, (x, options.height // 3), (x + options.width // 8, options.height // 2), (0, 200, 255), -1)
+        frames.append(frame)
+    return frames
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.array(values) * 1000.0
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+
+class CameraRun(object):
+    def __init__(self, name, options, frames):
+        self.name = name
+        self.options = options
+        self.frames = frames
+        self.sent = {}
+        self.withheld = 0
+        self.processed = set()
+        self.result_latency = []
+        self.display_latency = []
+        self.errors = []
+
+    def send(self, stop):
+        options = self.options
+        interval = 1.0 / options.fps
+        encoding = ENCODINGS[options.encoding]
+        try:
+            conn = socket.create_connection((options.host, options.port))
+            window = CreditWindow(conn) if options.credit else None
+            next_time = time.monotonic()
+            seq = 0
+            while not stop.is_set():
+                frame = self.frames[seq % len(self.frames)]
+                timestamp = time.time()
+                if window is not None and not window.acquire():
+                    # like a camera without credit: this capture is never sent
+                    self.withheld += 1
+                elif window is not None:
+                    send_frame(conn, self.name, frame, seq, timestamp, FLAG_CREDIT, encoding, options.jpeg_quality)
+                    self.sent[seq] = timestamp
+                elif options.legacy_pickle:
+                    send_legacy_frame(conn, self.name, frame)
+                    # the server numbers legacy frames from 1 per connection
+                    self.sent[seq + 1] = timestamp
+                else:
+                    send_frame(conn, self.name, frame, seq, timestamp, encoding=encoding, quality=options.jpeg_quality)
+                    self.sent[seq] = timestamp
+                seq += 1
+                next_time += interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.monotonic()
+            conn.close()
+        except OSError as e:
+            self.errors.append(f"send: {e}")
+
+    def poll_results(self, stop):
+        since = 0
+        url = f"{self.options.http}/inference/{self.name}?since="
+        while not stop.is_set():
+            try:
+                with urllib.request.urlopen(url + str(since), timeout=5) as response:
+                    data = json.load(response)
+            except OSError as e:
+                self.errors.append(f"poll: {e}")
+                time.sleep(1)
+                continue
+            now = time.time()
+            for entry in data.get("results", []):
+                since = max(since, entry["seq"])
+                frame_seq = entry.get("frame_seq")
+                if frame_seq in self.sent and frame_seq not in self.processed:
+                    self.processed.add(frame_seq)
+                    self.result_latency.append(now - self.sent[frame_seq])
+            time.sleep(self.options.poll_interval)
+
+    def watch_stream(self, stop):
+        try:
+            stream = urllib.request.urlopen(f"{self.options.http}/video_feed/{self.name}", timeout=10)
+            while not stop.is_set():
+                line = stream.readline()
+                if not line:
+                    break
+                if line.strip() != b'--frame':
+                    continue
+                headers = {}
+                while True:
+                    line = stream.readline().strip()
+                    if not line:
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                if 'content-length' in headers:
+                    stream.read(int(headers['content-length']))
+                if 'x-timestamp' in headers:
+                    self.display_latency.append(time.time() - float(headers['x-timestamp']))
+            stream.close()
+        except OSError as e:
+            self.errors.append(f"stream: {e}")
+
+    def report(self, duration):
+        sent = len(self.sent)
+        processed = len(self.processed)
+        return {
+            "sent": sent,
+            "withheld": self.withheld,
+            "processed": processed,
+            "drop_rate": 1.0 - processed / sent if sent else 0.0,
+            "sent_fps": sent / duration,
+            "processed_fps": processed / duration,
+            "result_latency_ms": percentiles(self.result_latency),
+            "display_latency_ms": percentiles(self.display_latency),
+            "errors": self.errors[:10],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic camera load generator")
+    parser.add_argument("--host", default="127.0.0.1", help="Ingest host")
+    parser.add_argument("--port", type=int, default=8080, help="Ingest TCP port")
+    parser.add_argument("--http", default=None, help="HTTP base url, defaults to http://<host>:5000")
+    parser.add_argument("--cameras", type=int, default=4, help="Number of simulated cameras")
+    parser.add_argument("--prefix", default="loadgen-", help="Camera name prefix")
+    parser.add_argument("--fps", type=float, default=10, help="Frames per second per camera")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--video", default=None, help="Replay this video file instead of synthetic frames")
+    parser.add_argument("--max-video-frames", type=int, default=300, help="Video frames decoded into memory for replay")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to send for")
+    parser.add_argument("--drain", type=float, default=3, help="Seconds to keep collecting results after sending stops")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Seconds between /inference polls")
+    parser.add_argument("--stream", action="store_true", help="Also measure display latency through /video_feed")
+    parser.add_argument("--legacy-pickle", action="store_true", help="Send the old length-prefixed pickle format")
+    parser.add_argument("--credit", action="store_true",
+                        help="Use credit flow control, captures without a credit are not sent")
+    parser.add_argument("--encoding", choices=sorted(ENCODINGS), default="raw",
+                        help="Payload encoding of the binary protocol, frames are compressed as they are sent")
+    parser.add_argument("--jpeg-quality", type=int, default=90)
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    options = parser.parse_args()
+    options.http = (options.http or f"http://{options.host}:5000").rstrip('/')
+
+    frames = load_frames(options)
+    runs = [CameraRun(f"{options.prefix}{i}", options, frames) for i in range(options.cameras)]
+    stop_sending = threading.Event()
+    stop_watching = threading.Event()
+    threads = []
+    for run in runs:
+        threads.append(threading.Thread(target=run.poll_results, args=(stop_watching,), daemon=True))
+        if options.stream:
+            threads.append(threading.Thread(target=run.watch_stream, args=(stop_watching,), daemon=True))
+    senders = [threading.Thread(target=run.send, args=(stop_sending,), daemon=True) for run in runs]
+    for thread in senders + threads:
+        thread.start()
+
+    start = time.time()
+    time.sleep(options.duration)
+    stop_sending.set()
+    for thread in senders:
+        thread.join()
+    duration = time.time() - start
+    time.sleep(options.drain)
+    stop_watching.set()
+
+    cameras = {run.name: run.report(duration) for run in runs}
+    sent = sum(camera["sent"] for camera in cameras.values())
+    processed = sum(camera["processed"] for camera in cameras.values())
+    report = {
+        "config": {key: value for key, value in vars(options).items()},
+        "duration_s": duration,
+        "total": {
+            "sent": sent,
+            "processed": processed,
+            "drop_rate": 1.0 - processed / sent if sent else 0.0,
+            "throughput_fps": processed / duration,
+            "result_latency_ms": percentiles([v for run in runs for v in run.result_latency]),
+            "display_latency_ms": percentiles([v for run in runs for v in run.display_latency]),
+        },
+        "cameras": cameras,
+    }
+    output = json.dumps(report, indent=4)
+    print(output)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
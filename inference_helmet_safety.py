@@ -1,181 +1,516 @@
 import argparse
-import pickle
-import struct
 import threading
-import queue
-import numpy as np
 import cv2
-import socket
-import torch
 import ssl
+import hmac
 import time, os, json
-from flask import Flask, Response, render_template, jsonify
-from ultralytics import YOLO
+from flask import Flask, Response, render_template, jsonify, request
+from libs import metrics
+from libs.startup import Startup
+from libs.backends import BACKENDS, load_model, model_artifact, warmup
+from libs.framing import ENCODING_RAW
+from libs.ingest import IngestServer
+from libs.cameras import CameraRegistry, CameraState
+from libs.results import ResultStore
+from libs.capture import LowConfidenceCapture
+from libs.batching import BatchScheduler
+from libs.tracking import CameraTracker, TRACK_CONF
+from libs.postprocess import DetectionRouter, load_routing_config
+from libs.recording import SegmentRecorder
+from libs.compliance import ComplianceEngine
+from libs.render import RENDERERS, BoxRenderer
+from libs.regions import RegionLayout, decode_target, load_region_config, region_settings
+from libs.motion import MOTION_DEFAULTS, MotionGate, load_motion_config, motion_settings
+from libs.workers import InferencePool
+from libs.swap import ModelSlot, ModelSwapper
 
 ssl._create_default_https_context = ssl._create_unverified_context
-frame_size = (640, 480)
+# model class -> result bucket, override or extend with --routes
+DEFAULT_ROUTES = {"helmet": "helmet", "head": "head", "safety-jacket": "safety-jacket"}
+# PPE every tracked worker must wear, override with --require
+DEFAULT_REQUIRED = "helmet,safety-jacket"
 CLIENT_TIMEOUT = 10
-file_path = 'data.json'
+# /video_feed waits this long for a first camera before giving up
+CAMERA_WAIT = 30
+DROP_POLICIES = ('skip', 'replace')
 save_directory = '/app/data/low_confidence_frames'
 
-if not os.path.exists(save_directory):
-    os.makedirs(save_directory, exist_ok=True)
-
 parser = argparse.ArgumentParser(description="YOLOv8 TCP Stream (Threaded, CPU)")
 parser.add_argument("--path", required=True, help="Path to YOLOv8 model")
 parser.add_argument("--port", type=int, default=8080, help="TCP port")
+parser.add_argument("--backend", choices=BACKENDS, default="torch",
+                    help="Inference engine, onnx/openvino artifacts are exported next to the .pt on first use")
+parser.add_argument("--legacy-pickle", action="store_true",
+                    help="Accept pickled (camera_name, frame) messages from old clients")
+parser.add_argument("--decode-workers", type=int, default=2,
+                    help="Threads decoding JPEG/PNG camera frames, large frames are decoded at reduced scale")
+parser.add_argument("--max-cameras", type=int, default=16, help="Maximum concurrent camera connections")
+parser.add_argument("--drop-policy", choices=DROP_POLICIES, default="skip",
+                    help="Full camera queue: skip new frames before decoding them, or decode and replace the queued one")
+parser.add_argument("--queue-size", type=int, default=1, help="Frames buffered per camera before dropping the oldest")
+parser.add_argument("--tracker", default="bytetrack.yaml", help="Tracker config, one instance per camera")
+parser.add_argument("--max-batch", type=int, default=4, help="Maximum frames per batched forward pass")
+parser.add_argument("--max-wait-ms", type=float, default=5, help="Maximum time to wait for a batch to fill")
+parser.add_argument("--result-history", type=int, default=100, help="Detection results kept in memory per camera")
+parser.add_argument("--persist-results", default=None, help="Also write the latest result to this json file in the background")
+parser.add_argument("--capture-interval", type=float, default=2.0, help="Minimum seconds between low confidence captures per camera")
+parser.add_argument("--capture-max-mb", type=int, default=2048, help="Disk budget for low confidence captures, oldest files are evicted")
+parser.add_argument("--imgsz", type=int, default=640,
+                    help="Model input size, frames are letterboxed once to imgsz x imgsz (multiple of 32)")
+parser.add_argument("--motion-threshold", type=float, default=MOTION_DEFAULTS["threshold"],
+                    help="Fraction of pixels that must change before a frame is inferred again, 0 infers every frame")
+parser.add_argument("--motion-refresh", type=float, default=MOTION_DEFAULTS["refresh_interval"],
+                    help="Run inference at least this often (seconds) even on static scenes")
+parser.add_argument("--motion-config", default=None, help="Json file with per camera motion gate settings")
+parser.add_argument("--region-config", default=None,
+                    help="Json file with per camera ROI polygons and tiling, only the ROI goes through the model")
+parser.add_argument("--tiles", action="store_true",
+                    help="Infer every camera's ROI as overlapping imgsz tiles merged with cross-tile NMS")
+parser.add_argument("--workers", type=int, default=0,
+                    help="Inference processes with their own model copy, 0 runs inference on a thread in this process")
+parser.add_argument("--worker-threads", type=int, default=None,
+                    help="Torch threads per inference process, defaults to cores / workers")
+parser.add_argument("--max-frame", default="1920x1080",
+                    help="Largest WxH frame handed to inference processes, bigger frames are downscaled")
+parser.add_argument("--renderer", choices=RENDERERS, default="fast",
+                    help="Overlay renderer for /video_feed, overlays are only drawn while someone is watching")
+parser.add_argument("--routes", default=None,
+                    help="Json file mapping model classes to result buckets, layered over DEFAULT_ROUTES")
+parser.add_argument("--record-dir", default=None, help="Record per camera MP4 segments into this directory")
+parser.add_argument("--record-fps", type=float, default=10, help="Frame rate of recorded segments")
+parser.add_argument("--record-segment", type=float, default=60, help="Seconds per recorded segment")
+parser.add_argument("--record-max-age-hours", type=float, default=24, help="Delete segments older than this")
+parser.add_argument("--record-max-mb", type=int, default=10240, help="Disk budget for segments, oldest are deleted")
+parser.add_argument("--record-events", action="store_true", help="Only record around violations")
+parser.add_argument("--record-preroll", type=float, default=5, help="Seconds kept before a violation")
+parser.add_argument("--record-postroll", type=float, default=10, help="Seconds kept after the last violation")
+parser.add_argument("--record-buckets", default="head", help="Comma separated result buckets that count as a violation")
+parser.add_argument("--require", default=DEFAULT_REQUIRED, help="Comma separated PPE classes every tracked worker must wear")
+parser.add_argument("--violation-start", type=float, default=1.0, help="Seconds PPE must be missing before a violation starts")
+parser.add_argument("--violation-end", type=float, default=2.0, help="Seconds PPE must be back before a violation ends")
+parser.add_argument("--admin-token", default=None,
+                    help="Token expected in the X-Admin-Token header of POST /admin/model, unset disables model swaps")
+parser.add_argument("--no-metrics", action="store_true", help="Disable /metrics and all stage timing")
 args = parser.parse_args()
+startup = Startup()
 
-model = YOLO(args.path)
-model.to('cpu')
-
-frame_queue = queue.Queue(maxsize=1)
-current_frame = None
-frame_lock = threading.Lock()
-
-def tcp_frame_receiver(port):
-    print("before connection")
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind(('0.0.0.0', port))
-    server_socket.listen(1)
-    print(f"[TCP] Listening on port {port}...")
-    print("after connection")
-    while True:
-        conn, addr = server_socket.accept()
-        print(f"[TCP] Connected from {addr}")
-        conn.settimeout(5.0)
-        data = b""
-        payload_size = struct.calcsize("Q")
-        print(f"payload size: {payload_size}")
-        last_data_time = time.time()
+if args.no_metrics:
+    metrics.disable()
 
-        try:
-            while True:
-                while len(data) < payload_size:
-                    packet = conn.recv(4096)
-                    if not packet:
-                        break
-                    data += packet
-
-                if not data:
-                    if time.time() - last_data_time > CLIENT_TIMEOUT:
-                        print("[TCP] Client timeout, closing connection.")
-                        break
-                    continue
-
-                packed_msg_size = data[:payload_size]
-                data = data[payload_size:]
-                msg_size = struct.unpack("Q", packed_msg_size)[0]
-
-                while len(data) < msg_size:
-                    data += conn.recv(4096)
-
-                frame_data = data[:msg_size]
-                data = data[msg_size:]
-                camera_name, frame = pickle.loads(frame_data)
-                frame = cv2.resize(frame, frame_size)
-                #np_data = np.frombuffer(frame_data, np.uint8)
-                #frame = cv2.imdecode(np_data, cv2.IMREAD_COLOR)
-                #print(f"FRAME ::::: {frame}")
-                if frame is None:
-                    continue
-
-                #frame = cv2.resize(frame, frame_size)
-
-                if frame_queue.full():
-                    try:
-                        frame_queue.get_nowait()
-                    except queue.Empty:
-                        pass
-                frame_queue.put(frame)
-
-                last_data_time = time.time()
+# loaded by start() while flask already answers and replaced by POST /admin/model,
+# with --workers every inference process holds its own copy
+models = ModelSlot()
+pool = None
 
-        except Exception as e:
-            print(f"[TCP] Exception: {e}")
-        finally:
-            conn.close()
-            print("[TCP] Connection closed.")
-
-def inference_worker():
-    global current_frame
-    frame_count = 0
-    print(f"inside inference_worker")
+cameras = CameraRegistry(queue_size=args.queue_size)
+result_store = ResultStore(history=args.result_history, persist_path=args.persist_results)
+capture = LowConfidenceCapture(save_directory, min_interval=args.capture_interval,
+                               max_bytes=args.capture_max_mb * 1024 * 1024)
+scheduler = BatchScheduler(cameras, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+motion_config = load_motion_config(args.motion_config)
+region_config = load_region_config(args.region_config)
+routing_config = load_routing_config(args.routes, DEFAULT_ROUTES)
+router = None
+renderer = BoxRenderer()
+recorder = None
+if args.record_dir:
+    recorder = SegmentRecorder(args.record_dir, fps=args.record_fps, segment_seconds=args.record_segment,
+                               max_age=args.record_max_age_hours * 3600,
+                               max_bytes=args.record_max_mb * 1024 * 1024, events=args.record_events,
+                               preroll=args.record_preroll, postroll=args.record_postroll)
+    metrics.register_collector(recorder.collect)
+record_buckets = [bucket.strip() for bucket in args.record_buckets.split(',') if bucket.strip()]
+compliance = ComplianceEngine([item.strip() for item in args.require.split(',') if item.strip()],
+                              start_seconds=args.violation_start, end_seconds=args.violation_end)
+metrics.register_collector(compliance.collect)
+metrics.register_collector(startup.collect)
+metrics.register_collector(cameras.collect)
+metrics.register_collector(capture.collect)
+
+def on_camera_frame(message, peer):
+    # the decoder reuses its payload buffer for the next frame, compressed frames arrive decoded
+    image = message.image.copy() if message.encoding == ENCODING_RAW else message.image
+    cameras.put(message.camera, image, message.seq, message.timestamp)
+
+def decode_size(name):
+    # ROI crops and tiles need the detail a reduced decode of the whole frame would throw away
+    return decode_target(region_settings(region_config, name, tiles=args.tiles or None), args.imgsz)
+
+def on_camera_skip(message, peer):
+    # refused before decoding, only counted
+    cameras.skip(message.camera)
+
+ingest = IngestServer('0.0.0.0', args.port, on_camera_frame,
+                      max_connections=args.max_cameras, read_timeout=CLIENT_TIMEOUT,
+                      legacy_pickle=args.legacy_pickle,
+                      accept=cameras.wants if args.drop_policy == "skip" else None,
+                      on_skip=on_camera_skip, credit_window=args.queue_size,
+                      decode_workers=args.decode_workers, decode_size=decode_size)
+metrics.register_collector(ingest.decoder.collect)
+# frames taken for inference give credit senders room for the next one;
+# at most queue-size frames in flight, so a credit sender never has a frame dropped
+cameras.release = ingest.release
+
+def motion_gate(camera):
+    if camera.motion is None:
+        camera.motion = MotionGate(**motion_settings(motion_config, camera.name,
+                                                     threshold=args.motion_threshold,
+                                                     refresh_interval=args.motion_refresh))
+    return camera.motion
+
+def routing(names):
+    # rebuilt only when the model's class names change
+    global router
+    if router is None or router.names != names:
+        router = DetectionRouter(names, routing_config)
+    return router
+
+def prepare(camera, frame):
+    # ROI crop, then one letterbox canvas, or one per tile
+    if camera.regions is None:
+        camera.regions = RegionLayout(args.imgsz, **region_settings(region_config, camera.name,
+                                                                    tiles=args.tiles or None))
+    with metrics.timed('letterbox'):
+        return camera.regions(frame)
+
+def show(camera, job, boxes, annotated_frame=None):
+    # only called when a /video_feed viewer wants this frame
+    if annotated_frame is None:
+        with metrics.timed('plot'):
+            annotated_frame = renderer.draw(job.frame, boxes)
+    camera.last_annotated = annotated_frame
+    camera.frame_slot.publish(annotated_frame, job.timestamp)
+
+def record(camera, job, detections, boxes, annotated_frame=None):
+    # hands the frame to the encoder thread, never waits for it
+    if recorder is None:
+        return
+    violation = any(detections.get(bucket) for bucket in record_buckets)
+    if annotated_frame is not None:
+        recorder.submit(camera.name, annotated_frame, job.timestamp, violation=violation)
+    else:
+        recorder.submit(camera.name, job.frame, job.timestamp, boxes, violation)
+
+def comply(camera, job, boxes):
+    # per track PPE state, only debounced violation start/end events are logged
+    with metrics.timed('compliance'):
+        events = compliance.update(camera.name, boxes, job.timestamp, job.seq)
+    for event in events:
+        print(f"[compliance] {json.dumps(event)}")
+
+def reuse_result(camera, job):
+    # nothing moved since the last inferred frame, republish its detections and tracks
+    result_store.publish(camera.name, camera.last_detections, frame_seq=job.seq, frame_timestamp=job.timestamp)
+    comply(camera, job, camera.last_boxes)
+    annotated_frame = None
+    if camera.broadcaster.wants_frame():
+        show(camera, job, camera.last_boxes, camera.last_annotated if args.renderer == "ultralytics" else None)
+        annotated_frame = camera.last_annotated
+    record(camera, job, camera.last_detections, camera.last_boxes, annotated_frame)
+    camera.mark_processed()
+
+def inference_worker(owner=None, run_batch=None):
+    print(f"inside inference_worker {'' if owner is None else owner}")
+    run_batch = run_batch or predict_batch
     while True:
-        try:
-            frame = frame_queue.get(timeout=1)
-        except queue.Empty:
-            print("Queue empty...", flush=True)
+        batch = scheduler.next_batch(timeout=1, owner=owner)
+        if not batch:
             continue
-        print("Processing frame...", flush=True)
-        results = model.track(frame, persist=True)
+        # one bad frame must not end the only thread serving these cameras
+        try:
+            gated = []
+            for camera, job in batch:
+                with metrics.timed('motion_gate'):
+                    changed = motion_gate(camera).should_infer(job.frame) or camera.last_detections is None
+                if changed:
+                    gated.append((camera, job))
+                else:
+                    reuse_result(camera, job)
+            batch = gated
+            if not batch:
+                continue
+            annotate = [camera.broadcaster.wants_frame() for camera, job in batch]
+            for (camera, job), wanted, output in zip(batch, annotate, run_batch(batch, annotate)):
+                if output is not None:
+                    publish_result(camera, job, *output, annotate=wanted)
+        except Exception as e:
+            print(f"Inference failed - exception {e}")
 
-        detections = {
-                "helmet": [], 
-                "head": [],
-                "safety-jacket": []
-        }
+def predict_batch(batch, annotate):
+    tiles = [prepare(camera, job.frame) for camera, job in batch]
+    frames = [tile for camera_tiles in tiles for tile in camera_tiles]
+    # a swap waits for this batch before the model it runs on is dropped
+    with models.use() as (model, epoch):
+        with metrics.timed('model'):
+            results = model.predict(frames, imgsz=args.imgsz, conf=TRACK_CONF,
+                                    batch=min(len(frames), args.max_batch), verbose=False)
+        outputs = []
+        for (camera, job), wanted, camera_tiles in zip(batch, annotate, tiles):
+            outputs.append(analyze(camera, job, results[:len(camera_tiles)], wanted and args.renderer == "ultralytics", epoch))
+            results = results[len(camera_tiles):]
+        return outputs
 
-        if len(results) > 0:
-            result = results[0]
-            for box in result.boxes:
-                confidence = float(box.conf)
-                cls_name = result.names[int(box.cls)]
-                detection = {"class": cls_name, "confidence": confidence}
+def analyze(camera, job, results, plot=False, epoch=0):
+    # tracking, detection buckets and ultralytics plotting; runs wherever the model runs
+    frame = job.frame
+    if camera.tracker is None or camera.tracker_epoch != epoch:
+        # new camera, or a model swap changed what the class ids mean
+        camera.tracker = CameraTracker(args.tracker)
+        camera.tracker_epoch = epoch
+    with metrics.timed('merge_tiles'):
+        result = camera.regions.restore(results, frame)
+    with metrics.timed('tracker'):
+        result = camera.tracker.update(result)
+    with metrics.timed('postprocess'):
+        detections, boxes, low_confidence = routing(result.names).route_result(result)
 
-                if confidence < 0.5:
-                    frame_count += 1
-                    frame_name = f"low_confidence_frame_{frame_count}.jpg"
-                    cv2.imwrite(os.path.join(save_directory, frame_name), frame)
+    annotated_frame = None
+    if plot:
+        with metrics.timed('plot'):
+            annotated_frame = result.plot()
+    return (detections, boxes, low_confidence), annotated_frame
 
-                if cls_name == "helmet":
-                    detections["helmet"].append(detection)
-                elif cls_name == "head":
-                    detections["head"].append(detection)
-                elif cls_name == ["safety-jacket"]:
-                    detections["safety-jacket"].append(detection)
+def publish_result(camera, job, payload, annotated_frame, annotate=False):
+    detections, boxes, low_confidence = payload
+    if low_confidence:
+        with metrics.timed('low_confidence_submit'):
+            capture.submit(camera.name, job.frame, boxes)
+    result_store.publish(camera.name, detections, frame_seq=job.seq, frame_timestamp=job.timestamp)
+    camera.last_detections = detections
+    camera.last_boxes = boxes
+    comply(camera, job, boxes)
+    # the fast renderer draws on job.frame, so this goes after the capture copy
+    if annotate:
+        show(camera, job, boxes, annotated_frame)
+    record(camera, job, detections, boxes, camera.last_annotated if annotate else None)
+    camera.mark_processed()
+    swapper.observe(time.monotonic() - job.enqueued)
 
-            with open(file_path, 'w') as f:
-                json.dump(detections, f, indent=4)
+def worker_setup(index):
+    # runs inside each inference process
+    model = load_model(args.path, args.backend, imgsz=args.imgsz)
+    warm_up(model)
+    models.swap(model, args.path)
+    states = {}
 
-            annotated_frame = result.plot()
-        else:
-            annotated_frame = frame.copy()
+    def run_batch(items):
+        batch = []
+        for name, job, annotate in items:
+            if name not in states:
+                states[name] = CameraState(name)
+            batch.append((states[name], job))
+        return predict_batch(batch, [annotate for _, _, annotate in items])
+
+    def control(message):
+        kind, path = message
+        if kind != "swap":
+            raise ValueError(f"Unknown control message {kind}")
+        return models.replace(path, lambda path: load_model(path, args.backend, imgsz=args.imgsz), warm_up)
+
+    return run_batch, control
+
+def unfit(output, frame):
+    # the worker saw the frame shrunk to --max-frame, put its boxes back on the full frame
+    ratio = pool.fit_ratio(frame.shape)
+    if output is None or ratio == 1.0:
+        return output
+    (detections, boxes, low_confidence), annotated_frame = output
+    boxes = [dict(box, xyxy=[v / ratio for v in box["xyxy"]]) for box in boxes]
+    if annotated_frame is not None:
+        annotated_frame = cv2.resize(annotated_frame, (frame.shape[1], frame.shape[0]))
+    return (detections, boxes, low_confidence), annotated_frame
 
-        with frame_lock:
-            current_frame = annotated_frame.copy()
+def pool_worker(index):
+    def run_batch(batch, annotate):
+        try:
+            outputs = pool.submit(index, [(camera.name, job, wanted) for (camera, job), wanted in zip(batch, annotate)])
+        except RuntimeError as e:
+            print(f"Inference failed - exception {e}")
+            time.sleep(1)
+            return [None] * len(batch)
+        return [unfit(output, job.frame) for (camera, job), output in zip(batch, outputs)]
+    inference_worker(index, run_batch)
+
+def warm_up(model):
+    # the first predict builds the predictor, the first tracker pulls in the tracker modules
+    result = warmup(model, args.imgsz, batch=args.max_batch, conf=TRACK_CONF)
+    CameraTracker(args.tracker).update(result)
+
+def swap_model(path):
+    # runs on the swapper's thread, cameras keep being served by the old model meanwhile
+    artifact = model_artifact(path, args.backend, args.imgsz)
+    if pool is None:
+        return models.replace(artifact, lambda path: load_model(path, args.backend, imgsz=args.imgsz), warm_up)
+    # one worker at a time, so only one of them is slowed down by loading
+    return {"workers": [pool.control(index, ("swap", artifact)) for index in range(len(pool.workers))]}
+
+swapper = ModelSwapper(swap_model, args.path)
+metrics.register_collector(swapper.collect)
+
+def start():
+    # cameras are only accepted once inference is warm, /readyz reports progress until then
+    try:
+        with startup.phase('model_artifact'):
+            model_artifact(args.path, args.backend, args.imgsz)
+        if pool is not None:
+            with startup.phase('workers'):
+                pool.start()
+            cameras.assign = pool.assign
+            metrics.register_collector(pool.collect)
+            for index in range(args.workers):
+                threading.Thread(target=pool_worker, args=(index,), daemon=True).start()
+        else:
+            with startup.phase('load_model'):
+                model = load_model(args.path, args.backend, imgsz=args.imgsz)
+            with startup.phase('warmup'):
+                warm_up(model)
+            models.swap(model, args.path)
+            threading.Thread(target=inference_worker, daemon=True).start()
+        with startup.phase('ingest'):
+            ingest.start()
+    except Exception as e:
+        startup.fail(e)
+        os._exit(1)
+    startup.mark_ready()
 
 app = Flask(__name__)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', cameras=cameras.names())
 
 @app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+@app.route('/video_feed/<camera>')
+def video_feed(camera=None):
+    # ?fps= caps how often overlays are drawn for this viewer
+    fps = request.args.get('fps', type=float)
+    if camera is not None and cameras.get(camera) is None:
+        return jsonify({'error': f'Camera {camera} not found'}), 404
+    return Response(generate_frames(camera, fps), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/cameras', methods=['GET'])
+def get_cameras():
+    connected = set(connection.camera for connection in list(ingest.connections))
+    data = {}
+    for name in cameras.names():
+        state = cameras.get(name)
+        data[name] = {
+            "connected": name in connected,
+            "received": state.received,
+            "dropped": state.dropped,
+            "skipped": state.skipped,
+            "viewers": state.broadcaster.viewers,
+            "last_seen": state.last_seen,
+            "motion": state.motion.snapshot() if state.motion is not None else None,
+            "worker": state.owner,
+        }
+    return jsonify(data)
+
+@app.route('/inference/stream', methods=['GET'])
+def stream_inference():
+    # ?camera= filters, ?changed=1 only sends results whose classes/tracks changed,
+    # ?since= or Last-Event-ID replays buffered results after a reconnect
+    since = request.args.get('since', type=int)
+    if since is None and request.headers.get('Last-Event-ID', '').isdigit():
+        since = int(request.headers['Last-Event-ID'])
+    changed_only = request.args.get('changed', '0').lower() in ('1', 'true', 'yes')
+    return Response(result_store.stream(request.args.get('camera'), changed_only, since),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/inference', methods=['GET'])
-def get_inference_data():
-    try:
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-        os.remove(file_path)
-        return jsonify(data)
-    except:
+@app.route('/inference/<camera>', methods=['GET'])
+def get_inference_data(camera=None):
+    since = request.args.get('since', type=int)
+    if since is not None:
+        return jsonify({"seq": result_store.seq, "results": result_store.since(since, camera)})
+    entry = result_store.latest(camera)
+    if entry is None:
         return jsonify({})
+    response = jsonify(entry["detections"])
+    response.headers['X-Result-Seq'] = str(entry["seq"])
+    return response
 
-def generate_frames():
-    while True:
-        with frame_lock:
-            frame = None if current_frame is None else current_frame.copy()
-        if frame is None:
-            time.sleep(0.03)
-            continue
-        ret, buffer = cv2.imencode('.jpg', frame)
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+@app.route('/compliance', methods=['GET'])
+def get_compliance():
+    # current per track PPE state, ?camera= filters
+    return jsonify(compliance.snapshot(request.args.get('camera')))
+
+@app.route('/compliance/events', methods=['GET'])
+def get_compliance_events():
+    since = request.args.get('since', 0, type=int)
+    return jsonify({"seq": compliance.log.seq, "events": compliance.log.since(since, request.args.get('camera'))})
+
+@app.route('/compliance/stream', methods=['GET'])
+def stream_compliance():
+    # violation_start/violation_end events, ?since= or Last-Event-ID replays after a reconnect
+    since = request.args.get('since', type=int)
+    if since is None and request.headers.get('Last-Event-ID', '').isdigit():
+        since = int(request.headers['Last-Event-ID'])
+    return Response(compliance.log.stream(request.args.get('camera'), since),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # the process is up and answering, the model may still be loading
+    return jsonify({"status": "ok", "uptime": startup.snapshot()["uptime"]})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # 200 once the model is warm and cameras are accepted, 503 with the current phase before that
+    data = startup.snapshot()
+    return jsonify(data), 200 if data["ready"] else 503
+
+@app.route('/admin/model', methods=['GET'])
+def get_model():
+    return jsonify(swapper.snapshot())
+
+@app.route('/admin/model', methods=['POST'])
+def swap_model_request():
+    # {"path": "<model file>"}: loaded and warmed in the background, then swapped in between batches
+    # loading a model file runs code from it, so nobody may swap without a configured token
+    if not args.admin_token:
+        return jsonify({'error': 'Model swaps are disabled, start with --admin-token'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), args.admin_token):
+        return jsonify({'error': 'Invalid admin token'}), 403
+    path = (request.get_json(silent=True) or {}).get('path')
+    if not path or not os.path.exists(path):
+        return jsonify({'error': f'Model file {path} not found'}), 400
+    if not swapper.start(path):
+        return jsonify({'error': 'A model swap is already running'}), 409
+    return jsonify({'status': 'swapping', 'path': path}), 202
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not metrics.enabled:
+        return Response("metrics disabled\n", status=404, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/batch_stats', methods=['GET'])
+def get_batch_stats():
+    return jsonify(scheduler.stats())
+
+def generate_frames(camera=None, fps=None):
+    state = cameras.default() if camera is None else cameras.get(camera)
+    deadline = time.monotonic() + CAMERA_WAIT
+    while state is None:
+        # no camera has connected yet, end the stream rather than hold the worker thread forever
+        if time.monotonic() > deadline:
+            return
+        time.sleep(0.1)
+        state = cameras.default()
+    yield from state.broadcaster.stream(fps)
+
+@app.route('/recording_stats', methods=['GET'])
+def get_recording_stats():
+    if recorder is None:
+        return jsonify({'error': 'Recording disabled'}), 404
+    return jsonify(recorder.snapshot())
+
+@app.route('/capture_stats', methods=['GET'])
+def get_capture_stats():
+    return jsonify(capture.snapshot())
 
 @app.route('/retain_files', methods=['GET'])
 def get_retrain_files():
@@ -190,7 +525,12 @@ def get_retrain_files():
         return {}
 
 if __name__ == "__main__":
-    threading.Thread(target=tcp_frame_receiver, args=(args.port,), daemon=True).start()
-    threading.Thread(target=inference_worker, daemon=True).start()
+    if args.workers > 0:
+        # fork while this is still the only thread, so no worker inherits a lock
+        # held by flask or a writer thread; they load the model once start() lets them
+        width, height = (int(v) for v in args.max_frame.lower().split('x'))
+        pool = InferencePool(args.workers, worker_setup, slots=args.max_batch,
+                             max_shape=(height, width, 3), threads=args.worker_threads)
+        pool.launch()
+    threading.Thread(target=start, daemon=True).start()
     app.run(host="0.0.0.0", port=5000, debug=False, threaded=True)
-
@@ -1,169 +1,294 @@
 import argparse
-import pickle
-import struct
 import threading
-import numpy as np
-import cv2
-import socket
-import torch
 import ssl
+import hmac
 import time, os, json
-from flask import Flask, Response, render_template, jsonify, send_file
-from ultralytics import YOLO
+from flask import Flask, Response, render_template, jsonify, request
+from libs import metrics
+from libs.startup import Startup
+from libs.backends import BACKENDS, load_model, warmup
+from libs.framing import ENCODING_RAW
+from libs.ingest import IngestServer
+from libs.cameras import CameraRegistry
+from libs.results import ResultStore
+from libs.capture import LowConfidenceCapture
+from libs.tracking import CameraTracker, TRACK_CONF
+from libs.postprocess import DetectionRouter, load_routing_config
+from libs.recording import SegmentRecorder
+from libs.compliance import ComplianceEngine
+from libs.render import RENDERERS, BoxRenderer
+from libs.regions import RegionLayout, decode_target, load_region_config, region_settings
+from libs.swap import ModelSlot, ModelSwapper
+from libs.motion import MOTION_DEFAULTS, MotionGate, load_motion_config, motion_settings
 
 ssl._create_default_https_context = ssl._create_unverified_context
+# model class -> result bucket, override or extend with --routes
+DEFAULT_ROUTES = {"helmet": "helmet", "head": "head", "safety-jacket": "safety-jacket"}
+# PPE every tracked worker must wear, override with --require
+DEFAULT_REQUIRED = "helmet,safety-jacket"
+DROP_POLICIES = ('skip', 'replace')
 
 parser = argparse.ArgumentParser(description="YOLOv8 Stream Inference Server")
 parser.add_argument("--path", required=True, help="Path to the YOLOv8 model")
+parser.add_argument("--backend", choices=BACKENDS, default="torch",
+                    help="Inference engine, onnx/openvino artifacts are exported next to the .pt on first use")
+parser.add_argument("--legacy-pickle", action="store_true",
+                    help="Accept pickled (camera_name, frame) messages from old clients")
+parser.add_argument("--decode-workers", type=int, default=2,
+                    help="Threads decoding JPEG/PNG camera frames, large frames are decoded at reduced scale")
+parser.add_argument("--drop-policy", choices=DROP_POLICIES, default="skip",
+                    help="Full camera queue: skip new frames before decoding them, or decode and replace the queued one")
+parser.add_argument("--max-cameras", type=int, default=16, help="Maximum concurrent camera connections")
+parser.add_argument("--result-history", type=int, default=100, help="Detection results kept in memory per camera")
+parser.add_argument("--persist-results", default=None, help="Also write the latest result to this json file in the background")
+parser.add_argument("--capture-interval", type=float, default=2.0, help="Minimum seconds between low confidence captures per camera")
+parser.add_argument("--capture-max-mb", type=int, default=2048, help="Disk budget for low confidence captures, oldest files are evicted")
+parser.add_argument("--imgsz", type=int, default=640,
+                    help="Model input size, frames are letterboxed once to imgsz x imgsz (multiple of 32)")
+parser.add_argument("--motion-threshold", type=float, default=MOTION_DEFAULTS["threshold"],
+                    help="Fraction of pixels that must change before a frame is inferred again, 0 infers every frame")
+parser.add_argument("--motion-refresh", type=float, default=MOTION_DEFAULTS["refresh_interval"],
+                    help="Run inference at least this often (seconds) even on static scenes")
+parser.add_argument("--motion-config", default=None, help="Json file with per camera motion gate settings")
+parser.add_argument("--region-config", default=None,
+                    help="Json file with per camera ROI polygons and tiling, only the ROI goes through the model")
+parser.add_argument("--tiles", action="store_true",
+                    help="Infer every camera's ROI as overlapping imgsz tiles merged with cross-tile NMS")
+parser.add_argument("--renderer", choices=RENDERERS, default="fast",
+                    help="Overlay renderer for /video_feed, overlays are only drawn while someone is watching")
+parser.add_argument("--routes", default=None,
+                    help="Json file mapping model classes to result buckets, layered over DEFAULT_ROUTES")
+parser.add_argument("--record-dir", default=None, help="Record per camera MP4 segments into this directory")
+parser.add_argument("--record-fps", type=float, default=20, help="Frame rate of recorded segments")
+parser.add_argument("--record-segment", type=float, default=60, help="Seconds per recorded segment")
+parser.add_argument("--record-max-age-hours", type=float, default=24, help="Delete segments older than this")
+parser.add_argument("--record-max-mb", type=int, default=10240, help="Disk budget for segments, oldest are deleted")
+parser.add_argument("--record-events", action="store_true", help="Only record around violations")
+parser.add_argument("--record-preroll", type=float, default=5, help="Seconds kept before a violation")
+parser.add_argument("--record-postroll", type=float, default=10, help="Seconds kept after the last violation")
+parser.add_argument("--record-buckets", default="head", help="Comma separated result buckets that count as a violation")
+parser.add_argument("--require", default=DEFAULT_REQUIRED, help="Comma separated PPE classes every tracked worker must wear")
+parser.add_argument("--violation-start", type=float, default=1.0, help="Seconds PPE must be missing before a violation starts")
+parser.add_argument("--violation-end", type=float, default=2.0, help="Seconds PPE must be back before a violation ends")
+parser.add_argument("--admin-token", default=None,
+                    help="Token expected in the X-Admin-Token header of POST /admin/model, unset disables model swaps")
+parser.add_argument("--no-metrics", action="store_true", help="Disable /metrics and all stage timing")
 args = parser.parse_args()
+startup = Startup()
 path = args.path
 
-model = YOLO(path)
+# loaded by start_server() while flask already answers and replaced by POST /admin/model
+models = ModelSlot()
 
 host = '0.0.0.0'
 port = 8080
 CLIENT_TIMEOUT = 10
+# /video_feed waits this long for a first camera before giving up
+CAMERA_WAIT = 30
 
 app = Flask(__name__)
-current_frame = None
-frame_lock = threading.Lock()
-file_path = 'data.json'
-video_writer = None
-video_file = 'output.mp4'
-frame_size = (640, 480)  # Set your expected frame size
-fps = 20
-
-
-def client_handler(connection):
-    global current_frame, video_writer
-    data = b""
-    payload_size = struct.calcsize("Q")
-    last_data_time = time.time()
-    frame_count = 0
-    save_directory = '/app/data/low_confidence_frames'
-
-    if not os.path.exists(save_directory):
-        os.makedirs(save_directory)
-
+save_directory = '/app/data/low_confidence_frames'
+cameras = CameraRegistry()
+result_store = ResultStore(history=args.result_history, persist_path=args.persist_results)
+capture = LowConfidenceCapture(save_directory, min_interval=args.capture_interval,
+                               max_bytes=args.capture_max_mb * 1024 * 1024)
+if args.no_metrics:
+    metrics.disable()
+motion_config = load_motion_config(args.motion_config)
+region_config = load_region_config(args.region_config)
+routing_config = load_routing_config(args.routes, DEFAULT_ROUTES)
+router = None
+renderer = BoxRenderer()
+recorder = None
+if args.record_dir:
+    recorder = SegmentRecorder(args.record_dir, fps=args.record_fps, segment_seconds=args.record_segment,
+                               max_age=args.record_max_age_hours * 3600,
+                               max_bytes=args.record_max_mb * 1024 * 1024, events=args.record_events,
+                               preroll=args.record_preroll, postroll=args.record_postroll)
+    metrics.register_collector(recorder.collect)
+record_buckets = [bucket.strip() for bucket in args.record_buckets.split(',') if bucket.strip()]
+compliance = ComplianceEngine([item.strip() for item in args.require.split(',') if item.strip()],
+                              start_seconds=args.violation_start, end_seconds=args.violation_end)
+metrics.register_collector(compliance.collect)
+metrics.register_collector(startup.collect)
+metrics.register_collector(cameras.collect)
+metrics.register_collector(capture.collect)
+
+
+def on_camera_frame(message, peer):
+    # the decoder reuses its payload buffer for the next frame, compressed frames arrive decoded
+    image = message.image.copy() if message.encoding == ENCODING_RAW else message.image
+    cameras.put(message.camera, image, message.seq, message.timestamp)
+
+def decode_size(name):
+    # ROI crops and tiles need the detail a reduced decode of the whole frame would throw away
+    return decode_target(region_settings(region_config, name, tiles=args.tiles or None), args.imgsz)
+
+def on_camera_skip(message, peer):
+    # refused before decoding, only counted
+    cameras.skip(message.camera)
+
+def motion_gate(camera):
+    if camera.motion is None:
+        camera.motion = MotionGate(**motion_settings(motion_config, camera.name,
+                                                     threshold=args.motion_threshold,
+                                                     refresh_interval=args.motion_refresh))
+    return camera.motion
+
+def routing(names):
+    # rebuilt only when the model's class names change
+    global router
+    if router is None or router.names != names:
+        router = DetectionRouter(names, routing_config)
+    return router
+
+def prepare(camera, frame):
+    # ROI crop, then one letterbox canvas, or one per tile
+    if camera.regions is None:
+        camera.regions = RegionLayout(args.imgsz, **region_settings(region_config, camera.name,
+                                                                    tiles=args.tiles or None))
+    with metrics.timed('letterbox'):
+        return camera.regions(frame)
+
+def show(camera, job, boxes, annotated_frame=None):
+    # only called when a /video_feed viewer wants this frame
+    if annotated_frame is None:
+        with metrics.timed('plot'):
+            annotated_frame = renderer.draw(job.frame, boxes)
+    camera.last_annotated = annotated_frame
+    camera.frame_slot.publish(annotated_frame, job.timestamp)
+    return annotated_frame
+
+def record(camera, job, detections, boxes, annotated_frame=None):
+    # hands the frame to the encoder thread, never waits for it
+    if recorder is None:
+        return
+    violation = any(detections.get(bucket) for bucket in record_buckets)
+    if annotated_frame is not None:
+        recorder.submit(camera.name, annotated_frame, job.timestamp, violation=violation)
+    else:
+        recorder.submit(camera.name, job.frame, job.timestamp, boxes, violation)
+
+def comply(camera, job, boxes):
+    # per track PPE state, only debounced violation start/end events are logged
+    with metrics.timed('compliance'):
+        events = compliance.update(camera.name, boxes, job.timestamp, job.seq)
+    for event in events:
+        print(f"[compliance] {json.dumps(event)}")
+
+def reuse_result(camera, job):
+    # nothing moved since the last inferred frame, republish its detections and tracks
+    result_store.publish(camera.name, camera.last_detections, frame_seq=job.seq, frame_timestamp=job.timestamp)
+    comply(camera, job, camera.last_boxes)
+    annotated_frame = None
+    if camera.broadcaster.wants_frame():
+        annotated_frame = show(camera, job, camera.last_boxes,
+                               camera.last_annotated if args.renderer == "ultralytics" else None)
+    record(camera, job, camera.last_detections, camera.last_boxes, annotated_frame)
+    camera.mark_processed()
+
+def inference_worker():
     while True:
         try:
-            while len(data) < payload_size:
-                packet = connection.recv(2 * 1024)
-                if not packet:
-                    break
-                data += packet
-
-            if not data:
-                current_time = time.time()
-                if current_time - last_data_time > CLIENT_TIMEOUT:
-                    print("Client stopped sending data. Closing the connection.")
-                    break
-
-            packed_msg_size = data[:payload_size]
-            data = data[payload_size:]
-            msg_size = struct.unpack("Q", packed_msg_size)[0]
-
-            while len(data) < msg_size:
-                data += connection.recv(2 * 1024)
-
-            frame_data = data[:msg_size]
-            data = data[msg_size:]
-
-            camera_name, frame = pickle.loads(frame_data)
-            frame = cv2.resize(frame, frame_size)
-            results = model.track(frame, persist=True)
+            item = cameras.next_frame(timeout=1)
+            if item is None:
+                continue
+
+            camera, job = item
+            frame = job.frame
+            with metrics.timed('motion_gate'):
+                infer = motion_gate(camera).should_infer(frame) or camera.last_detections is None
+            if not infer:
+                reuse_result(camera, job)
+                continue
+            # a swap waits for this frame before the model it runs on is dropped
+            with models.use() as (model, epoch):
+                with metrics.timed('model'):
+                    results = model.predict(prepare(camera, frame), imgsz=args.imgsz, conf=TRACK_CONF, verbose=False)
+            if camera.tracker is None or camera.tracker_epoch != epoch:
+                # new camera, or a model swap changed what the class ids mean
+                camera.tracker = CameraTracker()
+                camera.tracker_epoch = epoch
+            with metrics.timed('merge_tiles'):
+                results = [camera.regions.restore(results, frame)]
+            with metrics.timed('tracker'):
+                results = [camera.tracker.update(result) for result in results]
 
             for result in results:
-                detections = {
-                    "helmet": [],
-                    "head": [],
-                    "safety-jacket": []
-                }
-
-                for box in result.boxes:
-                    confidence = float(box.conf)
-                    if confidence < 0.5:
-                        frame_count += 1
-                        frame_name = f"low_confidence_frame_{frame_count}.jpg"
-                        frame_path = os.path.join(save_directory, frame_name)
-                        cv2.imwrite(frame_path, frame)
-
-                    detection = {
-                        "class": result.names[int(box.cls)],
-                        "confidence": confidence
-                    }
-                    if detection["class"] == "helmet":
-                        detections['helmet'].append(detection)
-                    elif detection["class"] == "head":
-                        detections['head'].append(detection)
-                    elif detection["class"] == "safety-jacket":
-                        detections.setdefault('safety-jacket', []).append(detection)
-
-                with open(file_path, 'w') as file:
-                    json.dump(detections, file, indent=4)
-                print(f"prediction = {json.dumps(detections, indent=4)}")
-
-            annotated_frame = results[0].plot()
-
-            # Save current frame for video stream and recording
-            with frame_lock:
-                current_frame = annotated_frame.copy()
-
-            # Save to video
-            if video_writer:
-                video_writer.write(annotated_frame)
-
-            # Optional: save for MJPEG stream
-            np.save('array.npy', annotated_frame)
-
-            last_data_time = time.time()
+                with metrics.timed('postprocess'):
+                    detections, boxes, low_confidence = routing(result.names).route_result(result)
+
+                if low_confidence:
+                    with metrics.timed('low_confidence_submit'):
+                        capture.submit(camera.name, frame, boxes)
+                result_store.publish(camera.name, detections, frame_seq=job.seq, frame_timestamp=job.timestamp)
+                camera.last_detections = detections
+                camera.last_boxes = boxes
+                comply(camera, job, boxes)
+
+            # Draw overlays only for a viewer; the fast renderer draws on frame
+            annotated_frame = None
+            if camera.broadcaster.wants_frame():
+                if args.renderer == "ultralytics":
+                    with metrics.timed('plot'):
+                        annotated_frame = results[0].plot()
+                annotated_frame = show(camera, job, camera.last_boxes, annotated_frame)
+
+            # Evidence footage is encoded on the recorder's own thread
+            record(camera, job, camera.last_detections, camera.last_boxes, annotated_frame)
+            camera.mark_processed()
+            swapper.observe(time.monotonic() - job.enqueued)
 
         except Exception as e:
-            print(f"Client disconnected - exception {e}")
-            cv2.destroyWindow(camera_name)
-            for _ in range(4):
-                cv2.waitKey(1)
-            break
-    connection.close()
-    return 0
-
-def accept_connections(server_socket):
-    while True:
-        client, address = server_socket.accept()
-        print('Connected to: ' + address[0] + ':' + str(address[1]))
-        threading.Thread(target=client_handler, args=(client,)).start()
-
-def start_server(host, port):
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        server_socket.bind((host, port))
-    except socket.error as e:
-        print(str(e))
-    print(f'Server is listening on port {port}...')
-    server_socket.listen()
-    threading.Thread(target=accept_connections, args=(server_socket,)).start()
+            print(f"Inference failed - exception {e}")
 
-def generate_frames():
-    loaded_array = None
+def warm_up(model):
+    # the first predict builds the predictor, the first tracker pulls in the tracker modules
+    result = warmup(model, args.imgsz, conf=TRACK_CONF)
+    CameraTracker().update(result)
 
-    while True:
-        try:
-            loaded_array = np.load('array.npy')
-            os.remove('array.npy')
-        except:
-            pass
-
-        if loaded_array is None:
-            continue
+def swap_model(path):
+    # runs on the swapper's thread, cameras keep being served by the old model meanwhile
+    return models.replace(path, lambda path: load_model(path, args.backend, imgsz=args.imgsz), warm_up)
 
-        ret, buffer = cv2.imencode('.jpg', loaded_array)
-        if not ret:
-            print("Failed to encode frame")
-            continue
-        frame = buffer.tobytes()
+swapper = ModelSwapper(swap_model, path)
+metrics.register_collector(swapper.collect)
 
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+def start_server(host, port):
+    # cameras are only accepted once inference is warm, /readyz reports progress until then
+    try:
+        with startup.phase('load_model'):
+            model = load_model(path, args.backend, imgsz=args.imgsz)
+        with startup.phase('warmup'):
+            warm_up(model)
+        models.swap(model, path)
+        server = IngestServer(host, port, on_camera_frame,
+                              max_connections=args.max_cameras, read_timeout=CLIENT_TIMEOUT,
+                              legacy_pickle=args.legacy_pickle,
+                              accept=cameras.wants if args.drop_policy == "skip" else None,
+                              on_skip=on_camera_skip, decode_workers=args.decode_workers,
+                              decode_size=decode_size)
+        metrics.register_collector(server.decoder.collect)
+        # frames taken for inference give credit senders room for the next one
+        cameras.release = server.release
+        threading.Thread(target=inference_worker, daemon=True).start()
+        with startup.phase('ingest'):
+            server.start()
+    except Exception as e:
+        startup.fail(e)
+        os._exit(1)
+    startup.mark_ready()
+
+def generate_frames(fps=None):
+    state = cameras.default()
+    deadline = time.monotonic() + CAMERA_WAIT
+    while state is None:
+        # no camera has connected yet, end the stream rather than hold the worker thread forever
+        if time.monotonic() > deadline:
+            return
+        time.sleep(0.1)
+        state = cameras.default()
+    yield from state.broadcaster.stream(fps)
 
 @app.route('/')
 def index():
@@ -171,22 +296,100 @@ def index():
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # ?fps= caps how often overlays are drawn for this viewer
+    fps = request.args.get('fps', type=float)
+    return Response(generate_frames(fps), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/inference/stream', methods=['GET'])
+def stream_inference():
+    # ?camera= filters, ?changed=1 only sends results whose classes/tracks changed,
+    # ?since= or Last-Event-ID replays buffered results after a reconnect
+    since = request.args.get('since', type=int)
+    if since is None and request.headers.get('Last-Event-ID', '').isdigit():
+        since = int(request.headers['Last-Event-ID'])
+    changed_only = request.args.get('changed', '0').lower() in ('1', 'true', 'yes')
+    return Response(result_store.stream(request.args.get('camera'), changed_only, since),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/inference', methods=['GET'])
-def get_inference_data():
-    try:
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-        os.remove(file_path)
-        return jsonify(data)
-    except FileNotFoundError:
-        return {}
-    except json.JSONDecodeError:
-        return {}
-    except IOError as e:
-        print(f"Error reading file {file_path}: {e}")
-        return {}
+@app.route('/inference/<camera>', methods=['GET'])
+def get_inference_data(camera=None):
+    since = request.args.get('since', type=int)
+    if since is not None:
+        return jsonify({"seq": result_store.seq, "results": result_store.since(since, camera)})
+    entry = result_store.latest(camera)
+    if entry is None:
+        return jsonify({})
+    response = jsonify(entry["detections"])
+    response.headers['X-Result-Seq'] = str(entry["seq"])
+    return response
+
+@app.route('/compliance', methods=['GET'])
+def get_compliance():
+    # current per track PPE state, ?camera= filters
+    return jsonify(compliance.snapshot(request.args.get('camera')))
+
+@app.route('/compliance/events', methods=['GET'])
+def get_compliance_events():
+    since = request.args.get('since', 0, type=int)
+    return jsonify({"seq": compliance.log.seq, "events": compliance.log.since(since, request.args.get('camera'))})
+
+@app.route('/compliance/stream', methods=['GET'])
+def stream_compliance():
+    # violation_start/violation_end events, ?since= or Last-Event-ID replays after a reconnect
+    since = request.args.get('since', type=int)
+    if since is None and request.headers.get('Last-Event-ID', '').isdigit():
+        since = int(request.headers['Last-Event-ID'])
+    return Response(compliance.log.stream(request.args.get('camera'), since),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # the process is up and answering, the model may still be loading
+    return jsonify({"status": "ok", "uptime": startup.snapshot()["uptime"]})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # 200 once the model is warm and cameras are accepted, 503 with the current phase before that
+    data = startup.snapshot()
+    return jsonify(data), 200 if data["ready"] else 503
+
+@app.route('/admin/model', methods=['GET'])
+def get_model():
+    return jsonify(swapper.snapshot())
+
+@app.route('/admin/model', methods=['POST'])
+def swap_model_request():
+    # {"path": "<model file>"}: loaded and warmed in the background, then swapped in between frames
+    # loading a model file runs code from it, so nobody may swap without a configured token
+    if not args.admin_token:
+        return jsonify({'error': 'Model swaps are disabled, start with --admin-token'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), args.admin_token):
+        return jsonify({'error': 'Invalid admin token'}), 403
+    model_path = (request.get_json(silent=True) or {}).get('path')
+    if not model_path or not os.path.exists(model_path):
+        return jsonify({'error': f'Model file {model_path} not found'}), 400
+    if not swapper.start(model_path):
+        return jsonify({'error': 'A model swap is already running'}), 409
+    return jsonify({'status': 'swapping', 'path': model_path}), 202
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not metrics.enabled:
+        return Response("metrics disabled\n", status=404, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/recording_stats', methods=['GET'])
+def get_recording_stats():
+    if recorder is None:
+        return jsonify({'error': 'Recording disabled'}), 404
+    return jsonify(recorder.snapshot())
+
+@app.route('/capture_stats', methods=['GET'])
+def get_capture_stats():
+    return jsonify(capture.snapshot())
 
 @app.route('/retain_files', methods=['GET'])
 def get_retrain_files():
@@ -202,5 +405,6 @@ def get_retrain_files():
 
 if __name__ == "__main__":
     threading.Thread(target=start_server, args=(host, port)).start()
-    app.run(host="0.0.0.0", port=5000, debug=True, threaded=True)
+    # the reloader would start a second process that loads the model again
+    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False, threaded=True)
 
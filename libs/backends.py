@@ -0,0 +1,112 @@
+import os
+import time
+
+import numpy as np
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+# exported artifacts are cached next to the .pt file
+ARTIFACT_SUFFIX = {
+    'fused': '_fused.pt',
+    'onnx': '.onnx',
+    'openvino': '_openvino_model',
+}
+
+
+def artifact_path(path, backend, suffix=''):
+    base = os.path.splitext(path)[0]
+    return base + suffix + ARTIFACT_SUFFIX[backend]
+
+
+def is_exported(path):
+    return path.endswith('.onnx') or path.rstrip('/').endswith('_openvino_model')
+
+
+def is_cached(target, path):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path)
+
+
+def export_model(path, backend, imgsz=640, **kwargs):
+    """
+    export a .pt checkpoint for the given engine unless an artifact newer
+    than the checkpoint is already cached, returns the artifact path
+    """
+    from ultralytics import YOLO
+
+    target = artifact_path(path, backend, kwargs.pop('suffix', ''))
+    if is_cached(target, path):
+        return target
+    print(f"Exporting {path} for {backend} at imgsz={imgsz}...")
+    exported = YOLO(path).export(format=backend, imgsz=imgsz, dynamic=True, device='cpu', **kwargs)
+    if os.path.abspath(exported) != os.path.abspath(target):
+        os.replace(exported, target)
+    return target
+
+
+def fuse_model(path):
+    """
+    cache a copy of a .pt checkpoint with conv+bn already fused and without
+    the optimizer/EMA training state, so loading reads a smaller file and
+    the first predict has nothing left to fuse; falls back to path on error
+    """
+    if path.endswith(ARTIFACT_SUFFIX['fused']):
+        return path
+    target = artifact_path(path, 'fused')
+    if is_cached(target, path):
+        return target
+    import torch
+    from ultralytics import YOLO
+
+    print(f"Fusing {path} into {target}...")
+    try:
+        model = YOLO(path, task='detect')
+        model.model.fuse(verbose=False)
+        ckpt = {"model": model.model, "train_args": (model.ckpt or {}).get("train_args", {}),
+                "date": time.strftime('%Y-%m-%dT%H:%M:%S')}
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        torch.save(ckpt, tmp_path)
+        os.replace(tmp_path, target)
+    except Exception as e:
+        print(f"Could not cache fused model {target}, loading {path} - exception {e}")
+        return path
+    return target
+
+
+def model_artifact(path, backend='torch', imgsz=640):
+    """
+    the file load_model() will read, created and cached on first use; call
+    it once before starting workers so they do not race to build it
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+    if is_exported(path):
+        return path
+    if backend == 'torch':
+        return fuse_model(path)
+    return export_model(path, backend, imgsz)
+
+
+def load_model(path, backend='torch', imgsz=640):
+    """
+    YOLO model for the chosen CPU engine; tracking, names and plotting go
+    through the same ultralytics Results API whatever the backend
+    """
+    from ultralytics import YOLO
+
+    artifact = model_artifact(path, backend, imgsz)
+    model = YOLO(artifact, task='detect')
+    if backend == 'torch' and not is_exported(artifact):
+        model.to('cpu')
+    return model
+
+
+def warmup(model, imgsz=640, batch=1, conf=0.25):
+    """
+    run a blank imgsz frame through the model at batch 1 and at batch, the
+    first predict builds the predictor and compiles the graph; returns the
+    last result
+    """
+    frame = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    for size in sorted({1, max(1, batch)}):
+        results = model.predict([frame] * size, imgsz=imgsz, conf=conf, batch=size, verbose=False)
+    return results[-1]
@@ -0,0 +1,61 @@
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+from libs import metrics
+
+
+class BatchScheduler(object):
+    """
+    groups frames from several cameras into one forward pass and keeps
+    batch size / queueing latency statistics for tuning per deployment
+    """
+
+    def __init__(self, cameras, max_batch=4, max_wait_ms=5, history=1000):
+        self.cameras = cameras
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.lock = threading.Lock()
+        self.histogram = Counter()
+        self.queue_waits = deque(maxlen=history)
+        self.batches = 0
+        self.frames = 0
+
+    def next_batch(self, timeout=1, owner=None):
+        batch = self.cameras.next_batch(self.max_batch, self.max_wait, timeout, owner)
+        if not batch:
+            return []
+        now = time.monotonic()
+        with self.lock:
+            self.batches += 1
+            self.frames += len(batch)
+            self.histogram[len(batch)] += 1
+            self.queue_waits.extend(now - job.enqueued for _, job in batch)
+        for _, job in batch:
+            metrics.observe('queue_wait', now - job.enqueued)
+        return batch
+
+    def stats(self):
+        with self.lock:
+            waits = np.array(self.queue_waits) * 1000.0
+            histogram = dict(sorted(self.histogram.items()))
+            batches, frames = self.batches, self.frames
+        data = {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batches,
+            "frames": frames,
+            "mean_batch_size": frames / batches if batches else 0.0,
+            "batch_size_histogram": histogram,
+            "queue_wait_ms": {},
+        }
+        if len(waits):
+            data["queue_wait_ms"] = {
+                "mean": float(waits.mean()),
+                "p50": float(np.percentile(waits, 50)),
+                "p95": float(np.percentile(waits, 95)),
+                "max": float(waits.max()),
+            }
+        return data
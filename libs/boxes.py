@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def box_area(boxes):
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def box_intersection(a, b):
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    return np.clip(rb - lt, 0, None).prod(axis=2)
+
+
+def box_iou(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    inter = box_intersection(a, b)
+    return inter / (box_area(a)[:, None] + box_area(b)[None, :] - inter + 1e-9)
+
+
+def box_containment(inner, outer):
+    """
+    fraction of each inner box that lies inside each outer box, shape (len(inner), len(outer))
+    """
+    if len(inner) == 0 or len(outer) == 0:
+        return np.zeros((len(inner), len(outer)))
+    return box_intersection(inner, outer) / (box_area(inner)[:, None] + 1e-9)
+
+
+def nms(boxes, scores, classes=None, iou=0.5, containment=None):
+    """
+    greedy non-maximum suppression, returns the indices of the kept boxes by
+    descending score; a box is also dropped when at least containment of the
+    smaller of it and a kept box lies inside the other, which catches objects
+    cut in two by a tile edge whichever part scores higher. Boxes of
+    different classes never suppress each other
+    """
+    order = np.argsort(-scores, kind='stable')
+    boxes = boxes[order]
+    suppress = box_iou(boxes, boxes) > iou
+    if containment is not None:
+        # both ways, a kept fragment also drops the whole box it is part of
+        contained = box_containment(boxes, boxes)
+        suppress |= np.maximum(contained, contained.T) >= containment
+    if classes is not None:
+        classes = classes[order]
+        suppress &= classes[:, None] == classes[None, :]
+    dropped = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for i in range(len(boxes)):
+        if dropped[i]:
+            continue
+        keep.append(i)
+        dropped |= suppress[i]
+    return order[keep]
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+from libs.framebuffer import FrameSlot
+from libs.streaming import MjpegBroadcaster
+
+# frame plus the sender's sequence number/timestamp and when it was queued
+QueuedFrame = namedtuple('QueuedFrame', ['frame', 'seq', 'timestamp', 'enqueued'])
+
+
+class CameraState(object):
+    """
+    per camera ingest queue, tracker and latest annotated frame
+    """
+
+    def __init__(self, name, queue_size=1):
+        self.name = name
+        self.owner = None
+        self.queue = deque(maxlen=queue_size)
+        self.tracker = None
+        # ModelSlot epoch the tracker was built for
+        self.tracker_epoch = 0
+        self.motion = None
+        self.regions = None
+        self.last_detections = None
+        self.last_boxes = None
+        self.last_annotated = None
+        self.frame_slot = FrameSlot()
+        self.broadcaster = MjpegBroadcaster(self.frame_slot)
+        self.received = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.processed = 0
+        self.fps = 0.0
+        self.last_processed = None
+        self.last_seen = None
+
+    def mark_processed(self, smoothing=0.1):
+        # exponential moving average of the inference rate for this camera
+        now = time.monotonic()
+        if self.last_processed is not None and now > self.last_processed:
+            self.fps += smoothing * (1.0 / (now - self.last_processed) - self.fps)
+        self.last_processed = now
+        self.processed += 1
+
+
+class CameraRegistry(object):
+    """
+    holds every camera seen on the ingest port and hands queued frames to the
+    inference stage round-robin, so one busy camera cannot starve the rest;
+    assign(name), when set, picks the owner (inference worker) of a new camera,
+    release(name, seq), when set, is told about every frame taken off a
+    queue for inference
+    """
+
+    def __init__(self, queue_size=1, assign=None, release=None):
+        self.queue_size = queue_size
+        self.assign = assign
+        self.release = release
+        self.cameras = {}
+        self.order = []
+        self.cursor = 0
+        self.ready = threading.Condition()
+
+    def get(self, name):
+        with self.ready:
+            return self.cameras.get(name)
+
+    def names(self):
+        with self.ready:
+            return list(self.order)
+
+    def default(self):
+        with self.ready:
+            return self.cameras[self.order[0]] if self.order else None
+
+    def _register(self, name):
+        state = self.cameras.get(name)
+        if state is None:
+            state = CameraState(name, self.queue_size)
+            if self.assign is not None:
+                state.owner = self.assign(name)
+            self.cameras[name] = state
+            self.order.append(name)
+        return state
+
+    def register(self, name):
+        with self.ready:
+            return self._register(name)
+
+    def wants(self, name):
+        """
+        whether a new frame from this camera would be queued without
+        dropping one, asked by ingest before it decodes the frame
+        """
+        with self.ready:
+            state = self.cameras.get(name)
+            return state is None or len(state.queue) < state.queue.maxlen
+
+    def skip(self, name):
+        # a frame ingest refused before decoding it
+        with self.ready:
+            state = self._register(name)
+            state.received += 1
+            state.skipped += 1
+            state.last_seen = time.time()
+
+    def put(self, name, frame, seq=None, timestamp=None):
+        with self.ready:
+            state = self._register(name)
+            if len(state.queue) == state.queue.maxlen:
+                # deque drops the oldest entry for us
+                state.dropped += 1
+            state.queue.append(QueuedFrame(frame, seq, timestamp, time.monotonic()))
+            state.received += 1
+            state.last_seen = time.time()
+            # several consumers may wait, each for the cameras it owns
+            self.ready.notify_all()
+
+    def _pop_next(self, exclude=(), owner=None):
+        count = len(self.order)
+        for i in range(count):
+            state = self.cameras[self.order[(self.cursor + i) % count]]
+            if state.queue and state.name not in exclude and state.owner == owner:
+                self.cursor = (self.cursor + i + 1) % count
+                job = state.queue.popleft()
+                if self.release is not None:
+                    self.release(state.name, job.seq)
+                return state, job
+        return None
+
+    def next_frame(self, timeout=None):
+        """
+        block until any camera has a frame, returns (camera state, QueuedFrame)
+        or None on timeout
+        """
+        with self.ready:
+            item = self._pop_next()
+            if item is None and self.ready.wait_for(self._has_frames, timeout):
+                item = self._pop_next()
+            return item
+
+    def next_batch(self, max_size, max_wait, timeout=None, owner=None):
+        """
+        block until any camera has a frame, then keep collecting at most one
+        frame per camera until max_size frames or max_wait seconds have passed;
+        returns a list of (camera state, QueuedFrame) from cameras of owner
+        """
+        with self.ready:
+            if not self.ready.wait_for(lambda: self._has_frames(owner=owner), timeout):
+                return []
+            batch = []
+            taken = set()
+            deadline = time.monotonic() + max_wait
+            while len(batch) < max_size:
+                item = self._pop_next(exclude=taken, owner=owner)
+                if item is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    if not self.ready.wait_for(lambda: self._has_frames(exclude=taken, owner=owner), remaining):
+                        break
+                    continue
+                batch.append(item)
+                taken.add(item[0].name)
+            return batch
+
+    def collect(self):
+        with self.ready:
+            states = [self.cameras[name] for name in self.order]
+            samples = [(state.name, len(state.queue), state.received, state.dropped,
+                        state.processed, state.fps) for state in states]
+            skipped = [({"camera": state.name}, state.skipped) for state in states]
+        viewers = [({"camera": state.name}, state.broadcaster.viewers) for state in states]
+        gated = [(state.name, state.motion) for state in states if state.motion is not None]
+        return [
+            ("ppe_camera_queue_depth", "gauge", "Frames waiting for inference",
+             [({"camera": name}, depth) for name, depth, _, _, _, _ in samples]),
+            ("ppe_camera_frames_received_total", "counter", "Frames received from the camera",
+             [({"camera": name}, received) for name, _, received, _, _, _ in samples]),
+            ("ppe_camera_frames_dropped_total", "counter", "Frames dropped by the drop-oldest queue",
+             [({"camera": name}, dropped) for name, _, _, dropped, _, _ in samples]),
+            ("ppe_camera_frames_skipped_total", "counter", "Frames refused by ingest before decoding, queue was full",
+             skipped),
+            ("ppe_camera_frames_processed_total", "counter", "Frames run through inference",
+             [({"camera": name}, processed) for name, _, _, _, processed, _ in samples]),
+            ("ppe_camera_fps", "gauge", "Smoothed inference frames per second",
+             [({"camera": name}, round(fps, 3)) for name, _, _, _, _, fps in samples]),
+            ("ppe_stream_viewers", "gauge", "Connected /video_feed viewers",
+             viewers),
+            ("ppe_motion_frames_total", "counter", "Frames inferred or skipped by the motion gate",
+             [({"camera": name, "decision": "inferred"}, gate.inferred) for name, gate in gated] +
+             [({"camera": name, "decision": "skipped"}, gate.skipped) for name, gate in gated]),
+        ]
+
+    def _has_frames(self, exclude=(), owner=None):
+        return any(self.cameras[name].queue and self.cameras[name].owner == owner
+                   for name in self.order if name not in exclude)
@@ -0,0 +1,152 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from libs import metrics
+
+
+def dhash(frame, size=8):
+    """
+    64 bit difference hash, cheap enough to run on every candidate frame
+    """
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class LowConfidenceCapture(object):
+    """
+    saves frames with uncertain detections for retraining without stalling
+    inference: one save per frame, near-duplicates and bursts per camera are
+    skipped, writes happen on a worker pool and the directory is capped in
+    bytes with oldest-first eviction; each jpg gets a json sidecar with boxes.
+    The writer threads start with the first capture, so inference processes
+    can still be forked before they exist
+    """
+
+    def __init__(self, directory, workers=2, queue_size=16, min_interval=2.0,
+                 max_bytes=2 * 1024 ** 3, hash_distance=6):
+        self.directory = directory
+        self.min_interval = min_interval
+        self.max_bytes = max_bytes
+        self.hash_distance = hash_distance
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.threads = []
+        self.lock = threading.Lock()
+        self.last_saved = {}
+        self.last_hash = {}
+        self.files = deque()
+        self.total_bytes = 0
+        self.counter = 0
+        self.stats = {"saved": 0, "duplicate": 0, "rate_limited": 0, "queue_full": 0, "evicted": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        # group a jpg and its sidecar so they are evicted together
+        captures = {}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                base = os.path.splitext(path)[0]
+                mtime, paths, size = captures.get(base, (0, [], 0))
+                captures[base] = (max(mtime, stat.st_mtime), paths + [path], size + stat.st_size)
+        for _, paths, size in sorted(captures.values()):
+            self.files.append((paths, size))
+            self.total_bytes += size
+
+    def submit(self, camera, frame, boxes, timestamp=None):
+        now = time.time() if timestamp is None else timestamp
+        with self.lock:
+            if now - self.last_saved.get(camera, 0) < self.min_interval:
+                self.stats["rate_limited"] += 1
+                return False
+        frame_hash = dhash(frame)
+        with self.lock:
+            last_hash = self.last_hash.get(camera)
+            if last_hash is not None and bin(frame_hash ^ last_hash).count('1') <= self.hash_distance:
+                self.stats["duplicate"] += 1
+                return False
+            self.counter += 1
+            counter = self.counter
+            if not self.threads:
+                self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(self.workers)]
+                for thread in self.threads:
+                    thread.start()
+        safe_camera = re.sub(r'[^A-Za-z0-9_.-]', '_', camera)
+        base_name = f"low_confidence_{safe_camera}_{int(now * 1000)}_{counter}"
+        sidecar = {"camera": camera, "timestamp": now, "boxes": boxes}
+        try:
+            self.queue.put_nowait((base_name, frame.copy(), sidecar))
+        except queue.Full:
+            with self.lock:
+                self.stats["queue_full"] += 1
+            return False
+        # only a queued frame counts for the rate limit and dedup, a dropped one must not hold back the next
+        with self.lock:
+            self.last_saved[camera] = now
+            self.last_hash[camera] = frame_hash
+        return True
+
+    def _run(self):
+        while True:
+            base_name, frame, sidecar = self.queue.get()
+            image_path = os.path.join(self.directory, base_name + '.jpg')
+            sidecar_path = os.path.join(self.directory, base_name + '.json')
+            start = time.perf_counter()
+            try:
+                cv2.imwrite(image_path, frame)
+                with open(sidecar_path, 'w') as f:
+                    json.dump(sidecar, f)
+                self._account(image_path, sidecar_path)
+                metrics.observe('low_confidence_save', time.perf_counter() - start)
+            except OSError as e:
+                print(f"Error saving low confidence frame {image_path}: {e}")
+
+    def _account(self, *paths):
+        size = sum(os.path.getsize(path) for path in paths)
+        evict = []
+        with self.lock:
+            self.files.append((list(paths), size))
+            self.total_bytes += size
+            self.stats["saved"] += 1
+            while self.total_bytes > self.max_bytes and self.files:
+                evicted_paths, evicted_size = self.files.popleft()
+                self.total_bytes -= evicted_size
+                evict.extend(evicted_paths)
+                self.stats["evicted"] += 1
+        for path in evict:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def collect(self):
+        with self.lock:
+            stats = dict(self.stats)
+            total_bytes = self.total_bytes
+        return [
+            ("ppe_capture_queue_depth", "gauge", "Low confidence frames waiting to be written",
+             [({}, self.queue.qsize())]),
+            ("ppe_capture_bytes", "gauge", "Bytes used by saved low confidence frames",
+             [({}, total_bytes)]),
+            ("ppe_capture_frames_total", "counter", "Low confidence frames by outcome",
+             [({"outcome": outcome}, count) for outcome, count in sorted(stats.items())]),
+        ]
+
+    def snapshot(self):
+        with self.lock:
+            data = dict(self.stats)
+            data["bytes"] = self.total_bytes
+            data["captures"] = len(self.files)
+        return data
@@ -0,0 +1,235 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from libs.boxes import box_containment, box_iou
+from libs.results import ResultSubscriber, sse_stream
+
+# boxes that stand for one worker; a helmet box is a head with a helmet on
+ANCHOR_CLASSES = ("person", "head", "helmet")
+# a head box grown into the body region where that worker's jacket should be
+BODY_WIDTH = 3.0
+BODY_HEIGHT = 7.0
+
+
+class EventLog(object):
+    """
+    ring buffer of compliance events with a global seq, pollable with
+    since() and pushable over SSE like the ResultStore
+    """
+
+    def __init__(self, history=1000):
+        self.events = deque(maxlen=history)
+        self.seq = 0
+        self.ready = threading.Condition()
+        self.subscribers = set()
+
+    def append(self, event):
+        with self.ready:
+            self.seq += 1
+            event["seq"] = self.seq
+            self.events.append(event)
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(event, None)
+        return event
+
+    def since(self, seq, camera=None):
+        with self.ready:
+            return [event for event in self.events
+                    if event["seq"] > seq and (camera is None or event["camera"] == camera)]
+
+    def subscribe(self, camera=None, since=None):
+        subscriber = ResultSubscriber(camera)
+        with self.ready:
+            for event in self.since(since, camera) if since is not None else []:
+                subscriber.offer(event, None)
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.ready:
+            self.subscribers.discard(subscriber)
+
+    def stream(self, camera=None, since=None):
+        return sse_stream(self, self.subscribe(camera, since), 'compliance')
+
+
+class TrackState(object):
+    def __init__(self, timestamp):
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.anchor = None
+        self.present = {}
+        self.missing = ()
+        self.violation_frames = 0
+        self.violating_since = None
+        self.compliant_since = None
+        self.active = False
+        self.started = None
+
+
+class ComplianceEngine(object):
+    """
+    per track PPE state from the router's boxes: anchors (person/head/helmet
+    tracks) are matched to helmet and jacket boxes with IoU and containment
+    matrices, and a violation only starts/ends after it has held for
+    start_seconds/end_seconds, so flicker does not raise alarms; update()
+    returns the violation_start/violation_end events, which also go to .log
+    """
+
+    def __init__(self, required=("helmet",), start_seconds=1.0, end_seconds=2.0, lost_seconds=3.0,
+                 iou_threshold=0.3, containment_threshold=0.6, history=1000):
+        self.required = tuple(required)
+        self.start_seconds = start_seconds
+        self.end_seconds = end_seconds
+        self.lost_seconds = lost_seconds
+        self.iou_threshold = iou_threshold
+        self.containment_threshold = containment_threshold
+        self.tracks = {}
+        self.lock = threading.Lock()
+        self.log = EventLog(history)
+        self.counts = {"violation_start": 0, "violation_end": 0}
+
+    def associate(self, classes, xyxy, anchors):
+        """
+        returns {item: bool array over anchors} saying which anchors wear each required item
+        """
+        anchor_boxes = xyxy[anchors]
+        anchor_classes = classes[anchors]
+        heads = anchor_classes != "person"
+        # body region below a head, the person box itself otherwise
+        regions = anchor_boxes.copy()
+        width = anchor_boxes[:, 2] - anchor_boxes[:, 0]
+        height = anchor_boxes[:, 3] - anchor_boxes[:, 1]
+        center = (anchor_boxes[:, 0] + anchor_boxes[:, 2]) / 2
+        regions[heads, 0] = center[heads] - width[heads] * BODY_WIDTH / 2
+        regions[heads, 2] = center[heads] + width[heads] * BODY_WIDTH / 2
+        regions[heads, 3] = anchor_boxes[heads, 1] + height[heads] * BODY_HEIGHT
+        present = {}
+        for item in self.required:
+            worn = anchor_classes == item
+            items = xyxy[classes == item]
+            if len(items):
+                if item == "helmet":
+                    # helmet on a head box, or inside the upper part of a person box
+                    matched = ((box_iou(anchor_boxes, items) >= self.iou_threshold) & heads[:, None]) | \
+                              ((box_containment(items, anchor_boxes).T >= self.containment_threshold) & ~heads[:, None])
+                else:
+                    matched = box_containment(items, regions).T >= self.containment_threshold
+                worn |= matched.any(axis=1)
+            present[item] = worn
+        return present
+
+    def update(self, camera, boxes, timestamp=None, frame_seq=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        events = []
+        tracked = [box for box in boxes if box.get("track_id") is not None]
+        with self.lock:
+            tracks = self.tracks.setdefault(camera, {})
+            if tracked:
+                classes = np.array([box["class"] for box in tracked], dtype=object)
+                xyxy = np.array([box["xyxy"] for box in tracked], dtype=np.float32)
+                track_ids = [box["track_id"] for box in tracked]
+                anchors = np.isin(classes, ANCHOR_CLASSES)
+                # a helmet box on top of a head box is that head's helmet, not a second worker
+                helmets = np.flatnonzero(classes == "helmet")
+                heads = np.flatnonzero(classes == "head")
+                if len(helmets) and len(heads):
+                    overlap = (box_iou(xyxy[helmets], xyxy[heads]) >= self.iou_threshold).any(axis=1)
+                    anchors[helmets[overlap]] = False
+                anchor_index = np.flatnonzero(anchors)
+                present = self.associate(classes, xyxy, anchor_index)
+                for row, index in enumerate(anchor_index.tolist()):
+                    flags = {item: bool(present[item][row]) for item in self.required}
+                    event = self._step(camera, tracks, track_ids[index], classes[index], flags,
+                                       timestamp, frame_seq)
+                    if event is not None:
+                        events.append(event)
+            for track_id, state in list(tracks.items()):
+                if timestamp - state.last_seen > self.lost_seconds:
+                    if state.active:
+                        events.append(self._event("violation_end", camera, track_id, state, timestamp,
+                                                  frame_seq, reason="lost"))
+                    del tracks[track_id]
+        for event in events:
+            self.counts[event["type"]] += 1
+            self.log.append(event)
+        return events
+
+    def _step(self, camera, tracks, track_id, anchor, present, timestamp, frame_seq):
+        state = tracks.get(track_id)
+        if state is None:
+            state = tracks[track_id] = TrackState(timestamp)
+        state.last_seen = timestamp
+        state.anchor = anchor
+        state.present = present
+        missing = tuple(item for item in self.required if not present[item])
+        if missing:
+            state.violation_frames += 1
+            state.compliant_since = None
+            if state.violating_since is None:
+                state.violating_since = timestamp
+            state.missing = missing
+        else:
+            state.violation_frames = 0
+            state.violating_since = None
+            if state.compliant_since is None:
+                state.compliant_since = timestamp
+        if not state.active and missing and timestamp - state.violating_since >= self.start_seconds:
+            state.active = True
+            state.started = state.violating_since
+            return self._event("violation_start", camera, track_id, state, timestamp, frame_seq)
+        if state.active and not missing and timestamp - state.compliant_since >= self.end_seconds:
+            state.active = False
+            return self._event("violation_end", camera, track_id, state, timestamp, frame_seq, reason="compliant")
+        return None
+
+    def _event(self, kind, camera, track_id, state, timestamp, frame_seq, reason=None):
+        event = {
+            "type": kind,
+            "camera": camera,
+            "track_id": track_id,
+            "missing": list(state.missing),
+            "timestamp": timestamp,
+            "frame_seq": frame_seq,
+            "since": state.started,
+        }
+        if kind == "violation_end":
+            # a lost track ended when it was last seen, not when it timed out
+            event["duration"] = (state.last_seen if reason == "lost" else timestamp) - state.started
+            event["reason"] = reason
+        return event
+
+    def snapshot(self, camera=None):
+        with self.lock:
+            cameras = [camera] if camera is not None else list(self.tracks)
+            return {
+                name: {
+                    str(track_id): {
+                        "anchor": state.anchor,
+                        "present": state.present,
+                        "violation": state.active,
+                        "missing": list(state.missing) if state.active else [],
+                        "violation_frames": state.violation_frames,
+                        "first_seen": state.first_seen,
+                        "last_seen": state.last_seen,
+                    }
+                    for track_id, state in self.tracks.get(name, {}).items()
+                }
+                for name in cameras
+            }
+
+    def collect(self):
+        with self.lock:
+            active = {camera: sum(state.active for state in tracks.values())
+                      for camera, tracks in self.tracks.items()}
+            counts = dict(self.counts)
+        return [
+            ("ppe_compliance_events_total", "counter", "Debounced compliance events by type",
+             [({"type": kind}, count) for kind, count in counts.items()]),
+            ("ppe_compliance_violations", "gauge", "Tracks currently in violation per camera",
+             [({"camera": camera}, count) for camera, count in active.items()]),
+        ]
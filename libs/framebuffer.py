@@ -0,0 +1,118 @@
+import multiprocessing
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class FrameSlot(object):
+    """
+    latest-frame exchange between threads: the writer copies into a
+    preallocated buffer and bumps a sequence number, readers block until
+    the sequence moves past the one they last saw
+    """
+
+    def __init__(self):
+        self.buffer = None
+        self.seq = 0
+        self.timestamp = None
+        self.ready = threading.Condition()
+
+    def publish(self, frame, timestamp=None):
+        with self.ready:
+            if self.buffer is None or self.buffer.shape != frame.shape or self.buffer.dtype != frame.dtype:
+                self.buffer = np.empty_like(frame)
+            np.copyto(self.buffer, frame)
+            self.timestamp = timestamp
+            self.seq += 1
+            self.ready.notify_all()
+        return self.seq
+
+    def wait(self, last_seq=0, timeout=None, out=None):
+        """
+        returns (seq, frame, source timestamp) once a frame newer than last_seq
+        exists, or (last_seq, None, None) on timeout; out is reused when its
+        shape matches
+        """
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.seq != last_seq, timeout):
+                return last_seq, None, None
+            if out is None or out.shape != self.buffer.shape or out.dtype != self.buffer.dtype:
+                out = np.empty_like(self.buffer)
+            np.copyto(out, self.buffer)
+            return self.seq, out, self.timestamp
+
+
+class SharedFrameSlot(object):
+    """
+    FrameSlot backed by multiprocessing.shared_memory so a frame can be
+    handed to another process without pickling it; pass the slot itself as
+    a Process argument, the child attaches to the same segment
+    """
+
+    # seq, height, width, channels, source timestamp (float64 bits)
+    META_SIZE = 5 * 8
+
+    def __init__(self, max_shape, dtype=np.uint8, name=None, condition=None):
+        self.max_shape = tuple(max_shape)
+        self.dtype = np.dtype(dtype)
+        capacity = int(np.prod(self.max_shape)) * self.dtype.itemsize
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.META_SIZE + capacity)
+        else:
+            try:
+                # only the creating process may unlink the segment
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                self.shm = shared_memory.SharedMemory(name=name)
+        self.ready = condition if condition is not None else multiprocessing.Condition()
+        self.meta = np.ndarray((5,), dtype=np.int64, buffer=self.shm.buf)
+        self.timestamps = self.meta[4:].view(np.float64)
+        self.data = np.ndarray((capacity,), dtype=np.uint8, buffer=self.shm.buf, offset=self.META_SIZE)
+        if self.owner:
+            self.meta[:] = 0
+
+    def __reduce__(self):
+        return (SharedFrameSlot, (self.max_shape, self.dtype, self.shm.name, self.ready))
+
+    @property
+    def seq(self):
+        return int(self.meta[0])
+
+    def _view(self, shape):
+        count = int(np.prod(shape))
+        return self.data[:count * self.dtype.itemsize].view(self.dtype).reshape(shape)
+
+    def publish(self, frame, timestamp=None):
+        if frame.nbytes > self.data.nbytes:
+            raise ValueError("frame {} does not fit slot of shape {}".format(frame.shape, self.max_shape))
+        with self.ready:
+            height, width = frame.shape[:2]
+            channels = frame.shape[2] if frame.ndim == 3 else 0
+            np.copyto(self._view(frame.shape), frame, casting='unsafe')
+            self.meta[1:4] = (height, width, channels)
+            self.timestamps[0] = float('nan') if timestamp is None else timestamp
+            self.meta[0] += 1
+            self.ready.notify_all()
+            return int(self.meta[0])
+
+    def wait(self, last_seq=0, timeout=None, out=None):
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.meta[0] != last_seq, timeout):
+                return last_seq, None, None
+            height, width, channels = (int(v) for v in self.meta[1:4])
+            shape = (height, width, channels) if channels else (height, width)
+            if out is None or out.shape != shape or out.dtype != self.dtype:
+                out = np.empty(shape, dtype=self.dtype)
+            np.copyto(out, self._view(shape))
+            timestamp = float(self.timestamps[0])
+            return int(self.meta[0]), out, None if np.isnan(timestamp) else timestamp
+
+    def close(self):
+        self.meta = None
+        self.timestamps = None
+        self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,402 @@
+import pickle
+import select
+import struct
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+MAGIC = b'PPEF'
+VERSION = 1
+
+ENCODING_RAW = 0
+ENCODING_JPEG = 1
+ENCODING_PNG = 2
+# compressed payloads carry the source height/width/channels in the header
+COMPRESSED = {ENCODING_JPEG: '.jpg', ENCODING_PNG: '.png'}
+# decode flag by downscale factor, libjpeg scales while decoding
+REDUCED_READS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# header flags: the sender waits for CREDIT messages before sending more frames
+FLAG_CREDIT = 0x01
+# frames a credit sender may send before its first grant
+INITIAL_CREDITS = 1
+
+# magic, version, encoding, dtype, flags, height, width, channels,
+# camera name length, timestamp, sequence number, payload length
+HEADER = struct.Struct('<4sBBBBIIIHdQQ')
+# old clients: native "Q" length prefix followed by pickle((camera_name, frame))
+LEGACY_HEADER = struct.Struct('Q')
+# node -> camera: magic, version, frames granted, sequence number of the frame released
+CREDIT_MAGIC = b'PPEC'
+CREDIT = struct.Struct('<4sBIQ')
+# payload bytes of a skipped frame are read into a scratch buffer of this size
+SKIP_CHUNK = 256 * 1024
+
+DTYPES = {
+    0: np.dtype(np.uint8),
+    1: np.dtype(np.uint16),
+    2: np.dtype(np.float32),
+}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+# image is None for a frame whose payload was skipped without decoding, and
+# the still compressed uint8 payload for encodings other than ENCODING_RAW
+Frame = namedtuple('Frame', ['camera', 'seq', 'timestamp', 'image', 'flags', 'encoding', 'shape'],
+                   defaults=(0, ENCODING_RAW, None))
+FrameHeader = namedtuple('FrameHeader', ['encoding', 'dtype', 'flags', 'shape',
+                                         'name_len', 'timestamp', 'seq', 'size'])
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def recv_exact(conn, view):
+    """
+    fill view from the socket with recv_into, returns False on a clean
+    EOF before the first byte and raises if the peer closes mid-message
+    """
+    received = 0
+    total = len(view)
+    while received < total:
+        n = conn.recv_into(view[received:])
+        if n == 0:
+            if received == 0:
+                return False
+            raise ConnectionError("peer closed connection mid-message")
+        received += n
+    return True
+
+
+def parse_header(header, max_payload=MAX_PAYLOAD):
+    (magic, version, encoding, dtype_code, flags, height, width, channels,
+     name_len, timestamp, seq, size) = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError("bad magic {!r}".format(magic))
+    if version != VERSION:
+        raise ProtocolError("unsupported protocol version {}".format(version))
+    if size > max_payload:
+        raise ProtocolError("payload of {} bytes exceeds limit".format(size))
+    if encoding != ENCODING_RAW and encoding not in COMPRESSED:
+        raise ProtocolError("unsupported encoding {}".format(encoding))
+    dtype = DTYPES.get(dtype_code)
+    if dtype is None:
+        raise ProtocolError("unsupported dtype code {}".format(dtype_code))
+    shape = (height, width, channels) if channels else (height, width)
+    if dtype != np.uint8:
+        # the pipeline only handles 8 bit BGR, other dtypes stay reserved in the format
+        raise ProtocolError("unsupported dtype {}, frames must be uint8".format(dtype))
+    if encoding in COMPRESSED:
+        if not size:
+            raise ProtocolError("empty compressed payload")
+    else:
+        if channels != 3 or not height or not width:
+            raise ProtocolError("unsupported raw frame shape {}, expected HxWx3 BGR".format(shape))
+        if int(np.prod(shape)) * dtype.itemsize != size:
+            raise ProtocolError("payload size {} does not match shape {}".format(size, shape))
+    return FrameHeader(encoding, dtype, flags, shape, name_len, timestamp, seq, size)
+
+
+def check_image(image):
+    # what legacy pickle senders hand over gets the same checks as a raw header
+    if not isinstance(image, np.ndarray) or image.dtype != np.uint8 or image.ndim != 3 \
+            or image.shape[2] != 3 or not image.size:
+        raise ProtocolError("unsupported legacy frame, expected a HxWx3 uint8 BGR array")
+    return image
+
+
+def decode_payload(header, payload):
+    if header.encoding in COMPRESSED:
+        return np.frombuffer(payload, dtype=np.uint8)
+    count = int(np.prod(header.shape))
+    return np.frombuffer(payload, dtype=header.dtype, count=count).reshape(header.shape)
+
+
+def reduce_factor(shape, target=None):
+    """
+    largest REDUCED_READS factor that keeps the long side of shape at or
+    above target, so the letterbox still only ever shrinks the frame
+    """
+    if not target or not shape or not shape[0] or not shape[1]:
+        return 1
+    long_side = max(shape[0], shape[1])
+    return max(factor for factor in REDUCED_READS if factor == 1 or long_side // factor >= target)
+
+
+def decode_image(frame, target=None):
+    """
+    BGR image of a compressed Frame, decoded at reduced scale when the
+    source is at least twice target on its long side
+    """
+    image = cv2.imdecode(frame.image, REDUCED_READS[reduce_factor(frame.shape, target)])
+    if image is None:
+        raise ProtocolError("could not decode {} byte payload".format(len(frame.image)))
+    return image
+
+
+def encode_image(image, encoding, quality=90):
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), quality] if encoding == ENCODING_JPEG else []
+    ret, buffer = cv2.imencode(COMPRESSED[encoding], image, params)
+    if not ret:
+        raise ProtocolError("could not encode frame")
+    return buffer
+
+
+class FrameReader(object):
+    """
+    reads versioned binary frames into a reusable buffer; the returned
+    image is a view over that buffer and is only valid until the next read()
+    """
+
+    def __init__(self, conn, max_payload=MAX_PAYLOAD):
+        self.conn = conn
+        self.max_payload = max_payload
+        self.header = bytearray(HEADER.size)
+        self.header_view = memoryview(self.header)
+        self.buffer = bytearray(0)
+
+    def _payload_view(self, size):
+        if size > len(self.buffer):
+            # allocate fresh rather than resize, old views may still be exported
+            self.buffer = bytearray(size)
+        return memoryview(self.buffer)[:size]
+
+    def read(self):
+        if not recv_exact(self.conn, self.header_view):
+            return None
+        header = parse_header(self.header, self.max_payload)
+
+        name = bytearray(header.name_len)
+        if header.name_len and not recv_exact(self.conn, memoryview(name)):
+            raise ConnectionError("peer closed connection mid-message")
+        payload = self._payload_view(header.size)
+        if header.size and not recv_exact(self.conn, payload):
+            raise ConnectionError("peer closed connection mid-message")
+
+        image = decode_payload(header, payload)
+        return Frame(name.decode('utf-8'), header.seq, header.timestamp, image, header.flags,
+                     header.encoding, header.shape)
+
+
+class LegacyPickleReader(FrameReader):
+    """
+    reads the old length-prefixed pickle messages, only use with trusted clients
+    """
+
+    def __init__(self, conn, max_payload=MAX_PAYLOAD):
+        super().__init__(conn, max_payload)
+        self.header = bytearray(LEGACY_HEADER.size)
+        self.header_view = memoryview(self.header)
+        self.seq = 0
+
+    def read(self):
+        if not recv_exact(self.conn, self.header_view):
+            return None
+        size = LEGACY_HEADER.unpack(self.header)[0]
+        if size > self.max_payload:
+            raise ProtocolError("payload of {} bytes exceeds limit".format(size))
+        payload = self._payload_view(size)
+        if not recv_exact(self.conn, payload):
+            raise ConnectionError("peer closed connection mid-message")
+        camera_name, image = pickle.loads(payload)
+        check_image(image)
+        self.seq += 1
+        return Frame(camera_name, self.seq, time.time(), image)
+
+
+class FrameDecoder(object):
+    """
+    incremental FrameReader for non-blocking sockets: fill get_buffer() and
+    report the byte count to buffer_updated(), which returns a Frame once
+    one is complete (valid until the next payload starts filling).
+    accept(camera), when set, is asked once the header and name are in; a
+    refused frame has its payload read into a small scratch buffer and is
+    returned with image None, without being copied or decoded
+    """
+
+    def __init__(self, legacy_pickle=False, max_payload=MAX_PAYLOAD, accept=None):
+        self.legacy_pickle = legacy_pickle
+        self.max_payload = max_payload
+        self.accept = accept
+        self.scratch = None
+        self.skip_left = 0
+        self.legacy_camera = None
+        self.header = bytearray(LEGACY_HEADER.size if legacy_pickle else HEADER.size)
+        self.name = bytearray(0)
+        self.buffer = bytearray(0)
+        self.frame_header = None
+        self.seq = 0
+        self._expect('header', memoryview(self.header))
+
+    def _expect(self, stage, view):
+        self.stage = stage
+        self.view = view
+        self.pos = 0
+
+    def _payload_view(self, size):
+        if size > len(self.buffer):
+            self.buffer = bytearray(size)
+        return memoryview(self.buffer)[:size]
+
+    def get_buffer(self):
+        return self.view[self.pos:]
+
+    def buffer_updated(self, nbytes):
+        self.pos += nbytes
+        frame = None
+        # zero length stages complete immediately, so keep stepping
+        while self.pos == len(self.view) and frame is None:
+            frame = self._advance()
+        return frame
+
+    def _skip(self, size):
+        if self.scratch is None:
+            self.scratch = memoryview(bytearray(SKIP_CHUNK))
+        self.skip_left = size
+        self._expect('skip', self.scratch[:min(size, SKIP_CHUNK)])
+
+    def _advance(self):
+        if self.stage == 'header':
+            if self.legacy_pickle:
+                size = LEGACY_HEADER.unpack(self.header)[0]
+                if size > self.max_payload:
+                    raise ProtocolError("payload of {} bytes exceeds limit".format(size))
+                # the name is inside the pickle, assume the camera this connection sent last
+                if self.accept is not None and self.legacy_camera is not None and size \
+                        and not self.accept(self.legacy_camera):
+                    self._skip(size)
+                    return None
+                self._expect('payload', self._payload_view(size))
+                return None
+            self.frame_header = parse_header(self.header, self.max_payload)
+            self.name = bytearray(self.frame_header.name_len)
+            self._expect('name', memoryview(self.name))
+            return None
+        if self.stage == 'name':
+            header = self.frame_header
+            # credit senders are already held to the node's pace, their frames are never refused
+            if self.accept is not None and header.size and not header.flags & FLAG_CREDIT \
+                    and not self.accept(self.name.decode('utf-8')):
+                self._skip(header.size)
+                return None
+            self._expect('payload', self._payload_view(header.size))
+            return None
+        if self.stage == 'skip':
+            self.skip_left -= len(self.view)
+            if self.skip_left:
+                self._expect('skip', self.scratch[:min(self.skip_left, SKIP_CHUNK)])
+                return None
+            self._expect('header', memoryview(self.header))
+            if self.legacy_pickle:
+                self.seq += 1
+                return Frame(self.legacy_camera, self.seq, time.time(), None)
+            header = self.frame_header
+            return Frame(self.name.decode('utf-8'), header.seq, header.timestamp, None, header.flags)
+
+        payload = self.view
+        self._expect('header', memoryview(self.header))
+        if self.legacy_pickle:
+            camera_name, image = pickle.loads(payload)
+            check_image(image)
+            self.seq += 1
+            self.legacy_camera = camera_name
+            return Frame(camera_name, self.seq, time.time(), image)
+        header = self.frame_header
+        image = decode_payload(header, payload)
+        return Frame(self.name.decode('utf-8'), header.seq, header.timestamp, image, header.flags,
+                     header.encoding, header.shape)
+
+
+def open_reader(conn, legacy_pickle=False):
+    if legacy_pickle:
+        return LegacyPickleReader(conn)
+    return FrameReader(conn)
+
+
+def pack_header(camera, image, seq, timestamp=None, flags=0, encoding=ENCODING_RAW, size=None, shape=None):
+    """
+    header for image, or for an already compressed payload of size bytes
+    whose source image had the given shape
+    """
+    dtype_code = DTYPE_CODES.get(image.dtype)
+    if dtype_code is None:
+        raise ProtocolError("unsupported dtype {}".format(image.dtype))
+    if timestamp is None:
+        timestamp = time.time()
+    name = camera.encode('utf-8')
+    shape = image.shape if shape is None else shape
+    height, width = shape[:2]
+    channels = shape[2] if len(shape) == 3 else 0
+    return HEADER.pack(MAGIC, VERSION, encoding, dtype_code, flags,
+                       height, width, channels, len(name),
+                       timestamp, seq, image.nbytes if size is None else size) + name
+
+
+def send_frame(conn, camera, image, seq, timestamp=None, flags=0, encoding=ENCODING_RAW, quality=90):
+    image = np.ascontiguousarray(image)
+    if encoding == ENCODING_RAW:
+        conn.sendall(pack_header(camera, image, seq, timestamp, flags))
+        conn.sendall(image.reshape(-1).data)
+        return
+    payload = encode_image(image, encoding, quality)
+    conn.sendall(pack_header(camera, image, seq, timestamp, flags, encoding, payload.nbytes, image.shape))
+    conn.sendall(payload.data)
+
+
+def send_legacy_frame(conn, camera, image):
+    payload = pickle.dumps((camera, image))
+    conn.sendall(LEGACY_HEADER.pack(len(payload)) + payload)
+
+
+def pack_credit(credits, seq=0):
+    return CREDIT.pack(CREDIT_MAGIC, VERSION, credits, seq)
+
+
+class CreditWindow(object):
+    """
+    sender side of credit flow control: send frames with FLAG_CREDIT and
+    call acquire() before each one; a camera that gets False should skip
+    the frame it captured instead of queueing it up
+    """
+
+    def __init__(self, conn, credits=INITIAL_CREDITS):
+        self.conn = conn
+        self.credits = credits
+        self.released = None
+        self.buffer = bytearray(CREDIT.size)
+        self.view = memoryview(self.buffer)
+
+    def poll(self, timeout=0):
+        """
+        read the grants the node has sent, waiting at most timeout (None
+        waits forever) for the first one
+        """
+        while select.select([self.conn], [], [], timeout)[0]:
+            if not recv_exact(self.conn, self.view):
+                raise ConnectionError("node closed connection")
+            magic, version, credits, seq = CREDIT.unpack(self.buffer)
+            if magic != CREDIT_MAGIC:
+                raise ProtocolError("bad credit magic {!r}".format(magic))
+            self.credits += credits
+            self.released = seq
+            timeout = 0
+
+    def acquire(self, timeout=0):
+        """
+        take a credit, True once one was available within timeout
+        """
+        if self.credits <= 0:
+            self.poll(timeout)
+        if self.credits <= 0:
+            return False
+        self.credits -= 1
+        return True
@@ -0,0 +1,298 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from libs import metrics
+from libs.framing import ENCODING_RAW, FLAG_CREDIT, INITIAL_CREDITS, FrameDecoder, decode_image, pack_credit
+
+# compressed frames of one camera waiting for a decode thread before the oldest is dropped
+MAX_PENDING_DECODES = 2
+
+
+class DecodePool(object):
+    """
+    decodes compressed frames on a few threads (cv2.imdecode releases the
+    GIL) so the event loop only ever copies their payload. Frames of one
+    camera are decoded in order, one at a time; size, when set, is the
+    model input, or size(camera) the long side that camera's frames need
+    (None for full resolution), and frames at least twice as large are
+    decoded at reduced scale. on_drop(message, peer) gets frames dropped
+    or failing to decode
+    """
+
+    def __init__(self, on_frame, on_drop=None, workers=2, size=None, max_pending=MAX_PENDING_DECODES):
+        self.on_frame = on_frame
+        self.on_drop = on_drop
+        self.size = size
+        self.targets = {}
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode')
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.running = set()
+        self.decoded = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, message, peer):
+        # the payload view is only valid until the connection's next frame starts filling
+        message = message._replace(image=message.image.copy())
+        dropped = None
+        with self.lock:
+            queue = self.pending.setdefault(message.camera, deque())
+            # credit senders are bounded by their window, never drop their frames
+            if len(queue) >= self.max_pending and not message.flags & FLAG_CREDIT:
+                dropped = queue.popleft()
+                self.dropped += 1
+            queue.append((message, peer))
+            if message.camera not in self.running:
+                self.running.add(message.camera)
+                self.executor.submit(self._drain, message.camera)
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped[0]._replace(image=None), dropped[1])
+
+    def _drain(self, camera):
+        while True:
+            with self.lock:
+                queue = self.pending[camera]
+                if not queue:
+                    self.running.discard(camera)
+                    return
+                message, peer = queue.popleft()
+            start = time.perf_counter()
+            try:
+                image = decode_image(message, self._target(camera))
+            except Exception as e:
+                print(f"[TCP] Could not decode frame {message.seq} of {camera} from {peer}: {e}")
+                with self.lock:
+                    self.failed += 1
+                if self.on_drop is not None:
+                    self.on_drop(message._replace(image=None), peer)
+                continue
+            metrics.observe('decode', time.perf_counter() - start)
+            with self.lock:
+                self.decoded += 1
+            try:
+                self.on_frame(message._replace(image=image), peer)
+            except Exception as e:
+                print(f"[TCP] Exception handling frame of {camera}: {e}")
+
+    def _target(self, camera):
+        if not callable(self.size):
+            return self.size
+        if camera not in self.targets:
+            self.targets[camera] = self.size(camera)
+        return self.targets[camera]
+
+    def collect(self):
+        with self.lock:
+            counts = (("decoded", self.decoded), ("dropped", self.dropped), ("failed", self.failed))
+            pending = sum(len(queue) for queue in self.pending.values())
+        return [
+            ("ppe_decode_frames_total", "counter", "Compressed frames by decode outcome",
+             [({"result": result}, value) for result, value in counts]),
+            ("ppe_decode_pending", "gauge", "Compressed frames waiting for a decode thread",
+             [({}, pending)]),
+        ]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class CameraProtocol(asyncio.BufferedProtocol):
+    """
+    one camera socket; the event loop recv_into()s straight into the
+    decoder buffers and frames are handed to the server callback. A sender
+    that sets FLAG_CREDIT is granted a credit for every frame taken off its
+    queue for inference, so it never sends faster than frames are inferred
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.decoder = FrameDecoder(server.legacy_pickle, accept=server.accept)
+        self.transport = None
+        self.peer = None
+        self.camera = None
+        self.deadline = None
+        self.receive_start = None
+        self.credit = False
+        self.skipped = 0
+        self.granted = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+        if len(self.server.connections) >= self.server.max_connections:
+            print(f"[TCP] Camera limit {self.server.max_connections} reached, rejecting {self.peer}")
+            transport.abort()
+            return
+        self.server.connections.add(self)
+        print(f"[TCP] Connected from {self.peer}")
+        self._reset_deadline()
+
+    def _reset_deadline(self):
+        if self.deadline is not None:
+            self.deadline.cancel()
+        self.deadline = self.server.loop.call_later(self.server.read_timeout, self._timed_out)
+
+    def _timed_out(self):
+        print(f"[TCP] Client {self.peer} timeout, closing connection.")
+        self.transport.abort()
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self._reset_deadline()
+        start = time.perf_counter()
+        if self.receive_start is None:
+            self.receive_start = start
+        try:
+            message = self.decoder.buffer_updated(nbytes)
+            if message is not None:
+                metrics.observe('socket_receive', start - self.receive_start)
+                self.receive_start = None
+                self.camera = message.camera
+                if message.flags & FLAG_CREDIT and not self.credit:
+                    self._start_credit()
+                if message.image is None:
+                    # refused before decoding, its payload only went through the scratch buffer
+                    self.skipped += 1
+                    if self.server.on_skip is not None:
+                        self.server.on_skip(message, self.peer)
+                    return
+                # the completing call includes unpickling/decoding the payload
+                metrics.observe('deserialize', time.perf_counter() - start)
+                if message.encoding != ENCODING_RAW:
+                    self.server.decoder.submit(message, self.peer)
+                    return
+                self.server.on_frame(message, self.peer)
+        except Exception as e:
+            print(f"[TCP] Exception from {self.peer}: {e}")
+            self.transport.abort()
+
+    def _start_credit(self):
+        self.credit = True
+        self.server.credit_connections[self.camera] = self
+        print(f"[TCP] {self.camera} at {self.peer} uses credit flow control, window {self.server.credit_window}")
+        if self.server.credit_window > INITIAL_CREDITS:
+            self.grant(self.server.credit_window - INITIAL_CREDITS)
+
+    def grant(self, credits, seq=0):
+        # loop thread only
+        if not self.credit or self.transport.is_closing():
+            return
+        self.transport.write(pack_credit(credits, seq))
+        self.granted += credits
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        if self.deadline is not None:
+            self.deadline.cancel()
+        if self not in self.server.connections:
+            return
+        self.server.connections.discard(self)
+        if self.server.credit_connections.get(self.camera) is self:
+            del self.server.credit_connections[self.camera]
+        if self.server.on_disconnect is not None:
+            self.server.on_disconnect(self.camera, self.peer)
+        print(f"[TCP] Connection {self.peer} closed.")
+
+
+class IngestServer(object):
+    """
+    single event loop serving every camera socket, replaces one thread per
+    connection; on_frame(message, peer) runs on the loop thread for raw
+    frames and on a DecodePool thread for compressed ones (message.image is
+    then the decoded image, message.encoding still the wire encoding), it
+    must not block. accept(camera), when set, decides before decoding
+    whether a frame is wanted, refused frames go to on_skip(message, peer)
+    with image None
+    """
+
+    def __init__(self, host, port, on_frame, on_disconnect=None,
+                 max_connections=16, read_timeout=10, legacy_pickle=False,
+                 accept=None, on_skip=None, credit_window=1,
+                 decode_workers=2, decode_size=None):
+        self.host = host
+        self.port = port
+        self.on_frame = on_frame
+        self.on_disconnect = on_disconnect
+        self.accept = accept
+        self.on_skip = on_skip
+        self.credit_window = max(INITIAL_CREDITS, credit_window)
+        self.credit_connections = {}
+        self.max_connections = max_connections
+        self.read_timeout = read_timeout
+        self.legacy_pickle = legacy_pickle
+        self.decoder = DecodePool(on_frame, self._decode_dropped, decode_workers, decode_size)
+        self.connections = set()
+        self.loop = None
+        self.server = None
+        self.started = threading.Event()
+        self.error = None
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await self.loop.create_server(
+            lambda: CameraProtocol(self), self.host, self.port,
+            reuse_address=True, backlog=self.max_connections)
+        print(f"[TCP] Listening on port {self.port}...")
+        self.started.set()
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for connection in list(self.connections):
+                connection.transport.abort()
+            self.server.close()
+            await self.server.wait_closed()
+            self.decoder.shutdown()
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    def _run(self):
+        try:
+            self.serve_forever()
+        except Exception as e:
+            self.error = e
+            print(f"[TCP] Ingest on port {self.port} stopped - exception {e}")
+            # a bind failure wakes start() right away instead of after its timeout
+            self.started.set()
+
+    def start(self, timeout=10):
+        """
+        serves on a thread of its own and returns once the port is bound,
+        raises RuntimeError when it could not be
+        """
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        if not self.started.wait(timeout) or self.error is not None:
+            raise RuntimeError(f"ingest port {self.port} is not listening: {self.error or 'timed out'}")
+        return thread
+
+    def _decode_dropped(self, message, peer):
+        if self.on_skip is not None:
+            self.on_skip(message, peer)
+        # a credit frame that never reaches the queue must still hand its credit back
+        if message.flags & FLAG_CREDIT:
+            self.release(message.camera, message.seq)
+
+    def release(self, camera, seq):
+        """
+        a frame of camera was taken for inference, grant its sender a new credit;
+        safe to call from any thread
+        """
+        connection = self.credit_connections.get(camera)
+        if connection is not None and self.loop is not None:
+            self.loop.call_soon_threadsafe(connection.grant, 1, seq)
+
+    def stop(self):
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
@@ -0,0 +1,132 @@
+"""
+minimal process-wide metrics in the Prometheus text format
+
+stages record latencies with observe()/timed(), everything else (queue
+depths, drops, fps, viewers) is read at scrape time from collectors so the
+hot path only pays for a bucket increment; disable() turns it all off
+"""
+import os
+import resource
+import threading
+import time
+from bisect import bisect_left
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+enabled = True
+_lock = threading.Lock()
+_stages = {}
+_collectors = []
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def observe(stage, seconds):
+    if not enabled:
+        return
+    with _lock:
+        series = _stages.get(stage)
+        if series is None:
+            series = _stages[stage] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        series[0][bisect_left(BUCKETS, seconds)] += 1
+        series[1] += seconds
+        series[2] += 1
+
+
+def drain():
+    """
+    returns and clears the stage histograms, for shipping them out of a worker process
+    """
+    with _lock:
+        stages = dict(_stages)
+        _stages.clear()
+    return stages
+
+
+def merge(stages):
+    if not enabled:
+        return
+    with _lock:
+        for stage, (counts, total, count) in stages.items():
+            series = _stages.get(stage)
+            if series is None:
+                series = _stages[stage] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+            series[2] += count
+
+
+class timed(object):
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+
+
+def register_collector(collector):
+    """
+    collector() returns [(name, type, help, [(labels dict, value), ...]), ...]
+    """
+    _collectors.append(collector)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels.items()) + '}'
+
+
+def _process_samples():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        rss = usage.ru_maxrss * 1024
+    return [
+        ("ppe_process_cpu_seconds_total", "counter", "User and system CPU time of the process",
+         [({}, usage.ru_utime + usage.ru_stime)]),
+        ("ppe_process_resident_memory_bytes", "gauge", "Resident set size of the process",
+         [({}, rss)]),
+        ("ppe_process_threads", "gauge", "Threads in the process",
+         [({}, threading.active_count())]),
+    ]
+
+
+def render():
+    lines = [
+        "# HELP ppe_stage_seconds Latency of each pipeline stage",
+        "# TYPE ppe_stage_seconds histogram",
+    ]
+    with _lock:
+        stages = {stage: (list(series[0]), series[1], series[2]) for stage, series in _stages.items()}
+    for stage, (counts, total, count) in sorted(stages.items()):
+        cumulative = 0
+        for bound, bucket in zip(BUCKETS, counts):
+            cumulative += bucket
+            lines.append('ppe_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(stage, bound, cumulative))
+        lines.append('ppe_stage_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(stage, count))
+        lines.append('ppe_stage_seconds_sum{{stage="{}"}} {}'.format(stage, total))
+        lines.append('ppe_stage_seconds_count{{stage="{}"}} {}'.format(stage, count))
+
+    families = _process_samples()
+    for collector in _collectors:
+        try:
+            families.extend(collector())
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,103 @@
+import json
+import time
+
+import cv2
+import numpy as np
+
+# defaults for every camera, override per camera with --motion-config
+MOTION_DEFAULTS = {
+    # fraction of downscaled pixels that must change to run inference, 0 disables the gate
+    "threshold": 0.002,
+    # grey level difference for a pixel to count as changed
+    "pixel_delta": 25,
+    # always run inference at least this often, seconds
+    "refresh_interval": 1.0,
+    # width of the downscaled frame the gate compares
+    "width": 160,
+}
+
+
+def load_motion_config(path):
+    """
+    json file {"defaults": {...}, "cameras": {"<name>": {...}}} with keys from MOTION_DEFAULTS
+    """
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def motion_settings(config, camera, **overrides):
+    settings = dict(MOTION_DEFAULTS)
+    settings.update((k, v) for k, v in overrides.items() if v is not None)
+    settings.update(config.get("defaults", {}))
+    settings.update(config.get("cameras", {}).get(camera, {}))
+    return settings
+
+
+class MotionGate(object):
+    """
+    cheap change detector in front of the model: a frame is compared with
+    the last frame that went through inference, downscaled and in grey, and
+    only frames that changed enough (or are due a forced refresh) get inferred
+    """
+
+    def __init__(self, threshold=0.002, pixel_delta=25, refresh_interval=1.0, width=160):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.refresh_interval = refresh_interval
+        self.width = width
+        self.reference = None
+        self.small = None
+        self.diff = None
+        self.last_inferred = 0.0
+        self.inferred = 0
+        self.skipped = 0
+        self.change = 0.0
+
+    def _downscale(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.width, max(1, int(round(height * self.width / width))))
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.small is None or self.small.shape != (size[1], size[0]):
+            self.small = np.empty((size[1], size[0]), dtype=gray.dtype)
+            self.diff = np.empty_like(self.small)
+        cv2.resize(gray, size, dst=self.small, interpolation=cv2.INTER_AREA)
+        # smooth sensor noise so it does not count as motion
+        cv2.GaussianBlur(self.small, (5, 5), 0, dst=self.small)
+        return self.small
+
+    def should_infer(self, frame, now=None):
+        """
+        returns True when the frame must go through the model; the caller
+        reuses the previous result otherwise
+        """
+        now = time.monotonic() if now is None else now
+        small = self._downscale(frame)
+        infer = (self.threshold <= 0 or self.reference is None
+                 or self.reference.shape != small.shape
+                 or now - self.last_inferred >= self.refresh_interval)
+        if not infer:
+            cv2.absdiff(small, self.reference, dst=self.diff)
+            self.change = float(np.count_nonzero(self.diff > self.pixel_delta)) / self.diff.size
+            infer = self.change >= self.threshold
+        if infer:
+            if self.reference is None or self.reference.shape != small.shape:
+                self.reference = small.copy()
+            else:
+                np.copyto(self.reference, small)
+            self.last_inferred = now
+            self.inferred += 1
+        else:
+            self.skipped += 1
+        return infer
+
+    def snapshot(self):
+        total = self.inferred + self.skipped
+        return {
+            "inferred": self.inferred,
+            "skipped": self.skipped,
+            "skip_ratio": self.skipped / total if total else 0.0,
+            "last_change": self.change,
+            "threshold": self.threshold,
+        }
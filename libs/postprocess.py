@@ -0,0 +1,92 @@
+import json
+
+import numpy as np
+
+LOW_CONFIDENCE = 0.5
+
+
+def load_routing_config(path, routes=None):
+    """
+    json file {"routes": {"<class>": "<bucket>" or null}, "buckets": [...],
+    "min_confidence": {"<class>": 0.3}, "low_confidence": 0.5} layered over routes
+    """
+    config = {"routes": dict(routes or {})}
+    if path:
+        with open(path) as f:
+            loaded = json.load(f)
+        config["routes"].update(loaded.get("routes", {}))
+        config.update((k, v) for k, v in loaded.items() if k != "routes")
+    return config
+
+
+class DetectionRouter(object):
+    """
+    turns a result into the per-bucket detection dict with one numpy pass:
+    class ids index a table built from model.names, so routing a box is a
+    lookup instead of string comparisons. Classes the routes do not mention
+    go to a bucket named after the class, a null route drops them
+    """
+
+    def __init__(self, names, config):
+        self.names = dict(names)
+        routes = config.get("routes", {})
+        self.buckets = list(config.get("buckets") or dict.fromkeys(b for b in routes.values() if b))
+        self.low_confidence = config.get("low_confidence", LOW_CONFIDENCE)
+        size = max(self.names, default=-1) + 1
+        self.class_names = np.array([self.names.get(i, str(i)) for i in range(size)], dtype=object)
+        # bucket index per class id, -1 for classes that are not reported
+        self.route = np.full(size, -1, dtype=np.int64)
+        self.min_confidence = np.zeros(size, dtype=np.float32)
+        for cls, name in self.names.items():
+            # a swapped in model may bring classes nobody wrote a route for
+            bucket = routes[name] if name in routes else name
+            if bucket:
+                if bucket not in self.buckets:
+                    self.buckets.append(bucket)
+                self.route[cls] = self.buckets.index(bucket)
+            self.min_confidence[cls] = config.get("min_confidence", {}).get(name, 0.0)
+        missing = [name for name in routes if name not in self.names.values()]
+        if missing:
+            print(f"Routing config classes not in model: {missing}")
+
+    def route_result(self, result):
+        """
+        returns (detections per bucket, every box with xyxy, any box below low_confidence)
+        """
+        data = result.boxes.data
+        data = data.cpu().numpy() if hasattr(data, 'cpu') else np.asarray(data)
+        return self.route_boxes(data)
+
+    def route_boxes(self, data):
+        detections = {bucket: [] for bucket in self.buckets}
+        if len(data) == 0:
+            return detections, [], False
+        # ultralytics layout: x1 y1 x2 y2 [track id] conf cls
+        conf = data[:, -2]
+        cls = data[:, -1].astype(np.int64)
+        track = data[:, 4].astype(np.int64).tolist() if data.shape[1] == 7 else [None] * len(data)
+        known = (cls >= 0) & (cls < len(self.route))
+        if not known.all():
+            # ids the model does not name are kept in boxes but never routed
+            names = [self.class_names[c] if ok else str(c) for c, ok in zip(cls.tolist(), known.tolist())]
+            cls = np.where(known, cls, -1)
+            routed = np.where(known, self.route[np.maximum(cls, 0)], -1)
+        else:
+            names = self.class_names[cls].tolist()
+            routed = self.route[cls]
+        reported = (routed >= 0) & (conf >= self.min_confidence[np.maximum(cls, 0)])
+
+        conf_list = conf.tolist()
+        boxes = []
+        for name, confidence, track_id, xyxy in zip(names, conf_list, track, data[:, :4].tolist()):
+            box = {"class": name, "confidence": confidence, "xyxy": xyxy}
+            if track_id is not None:
+                box["track_id"] = track_id
+            boxes.append(box)
+        bucket_names = self.buckets
+        for i in np.flatnonzero(reported).tolist():
+            detection = {"class": names[i], "confidence": conf_list[i]}
+            if track[i] is not None:
+                detection["track_id"] = track[i]
+            detections[bucket_names[routed[i]]].append(detection)
+        return detections, boxes, bool((conf < self.low_confidence).any())
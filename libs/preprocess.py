@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+PAD_COLOR = 114
+
+
+def letterbox(image, imgsz):
+    """
+    resize keeping aspect ratio and pad to imgsz x imgsz like ultralytics does
+    """
+    height, width = image.shape[:2]
+    ratio = min(imgsz / height, imgsz / width)
+    new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((imgsz, imgsz, 3), PAD_COLOR, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    canvas[top:top + new_h, left:left + new_w] = resized
+    return canvas
+
+
+class Letterbox(object):
+    """
+    one resize of a camera frame straight into a preallocated imgsz x imgsz
+    canvas, so ultralytics has nothing left to resize; remembers the scale
+    and padding to map boxes back onto the original frame
+    """
+
+    def __init__(self, imgsz=640):
+        self.imgsz = imgsz
+        self.canvas = np.full((imgsz, imgsz, 3), PAD_COLOR, dtype=np.uint8)
+        self.source_shape = None
+        self.region = None
+        self.size = None
+        self.ratio = 1.0
+        self.pad = (0, 0)
+
+    def _layout(self, shape):
+        height, width = shape
+        self.ratio = min(self.imgsz / height, self.imgsz / width)
+        new_w, new_h = int(round(width * self.ratio)), int(round(height * self.ratio))
+        top, left = (self.imgsz - new_h) // 2, (self.imgsz - new_w) // 2
+        self.canvas[:] = PAD_COLOR
+        self.region = self.canvas[top:top + new_h, left:left + new_w]
+        self.size = (new_w, new_h)
+        self.pad = (left, top)
+        self.source_shape = shape
+
+    def __call__(self, image):
+        """
+        returns the canvas, it is overwritten by the next call
+        """
+        if image.shape[:2] != self.source_shape:
+            self._layout(image.shape[:2])
+        if self.size == (image.shape[1], image.shape[0]):
+            np.copyto(self.region, image)
+        else:
+            cv2.resize(image, self.size, dst=self.region, interpolation=cv2.INTER_LINEAR)
+        return self.canvas
+
+    def unmap(self, boxes):
+        """
+        canvas xyxy -> original frame xyxy, in place on a numpy array or tensor
+        """
+        left, top = self.pad
+        boxes[:, [0, 2]] -= left
+        boxes[:, [1, 3]] -= top
+        boxes[:, :4] /= self.ratio
+        return boxes
+
@@ -0,0 +1,134 @@
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from libs.boxes import box_iou
+from libs.preprocess import letterbox
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png')
+
+
+def list_images(folder):
+    paths = []
+    for pattern in IMAGE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(folder, pattern)))
+    return sorted(paths)
+
+
+def to_blob(image, imgsz):
+    # BGR HWC uint8 -> RGB NCHW float32 in [0, 1]
+    padded = letterbox(image, imgsz)
+    return np.ascontiguousarray(padded[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+def calibration_reader(paths, input_name, imgsz):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class ImageCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(paths)
+
+        def get_next(self):
+            for path in self.paths:
+                image = cv2.imread(path)
+                if image is not None:
+                    return {input_name: to_blob(image, imgsz)}
+            return None
+
+    return ImageCalibrationReader()
+
+
+def quantize_onnx(fp32_path, int8_path, paths, imgsz):
+    """
+    static INT8 quantization (QDQ, per-channel weights) calibrated on images,
+    keeps the ultralytics metadata so names/imgsz load the same way
+    """
+    import onnx
+    import onnxruntime
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+
+    input_name = onnxruntime.InferenceSession(fp32_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    quantize_static(fp32_path, int8_path, calibration_reader(paths, input_name, imgsz),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    source = onnx.load(fp32_path)
+    quantized = onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, int8_path)
+
+
+def average_precision(tp, conf, total):
+    if total == 0:
+        return float('nan')
+    order = np.argsort(-conf)
+    tp = np.asarray(tp, dtype=float)[order]
+    tp_cum = np.cumsum(tp)
+    recall = tp_cum / total
+    precision = tp_cum / np.arange(1, len(tp) + 1)
+    # all-point interpolated area under the precision/recall curve
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    idx = np.where(mrec[1:] != mrec[:-1])[0]
+    return float(np.sum((mrec[idx + 1] - mrec[idx]) * mpre[idx + 1]))
+
+
+def predict_boxes(model, images, imgsz, conf):
+    boxes = []
+    latencies = []
+    for image in images:
+        start = time.perf_counter()
+        result = model.predict(image, imgsz=imgsz, conf=conf, verbose=False)[0]
+        latencies.append(time.perf_counter() - start)
+        boxes.append(result.boxes.data.cpu().numpy())
+    return boxes, np.array(latencies) * 1000.0
+
+
+def agreement(reference, candidate, names, classes, iou_threshold=0.5, recall_conf=0.25):
+    """
+    per class AP50 and recall of candidate predictions measured against the
+    reference model's predictions, for unlabeled calibration frames
+    """
+    report = {}
+    for name in classes:
+        if name not in names.values():
+            continue
+        cls = [k for k, v in names.items() if v == name][0]
+        tp, conf, total, hits = [], [], 0, 0
+        for ref, cand in zip(reference, candidate):
+            ref = ref[ref[:, 5] == cls]
+            cand = cand[cand[:, 5] == cls]
+            total += len(ref)
+            cand = cand[np.argsort(-cand[:, 4])]
+            ious = box_iou(cand[:, :4], ref[:, :4])
+            matched = set()
+            for i in range(len(cand)):
+                j = int(np.argmax(ious[i])) if len(ref) else -1
+                hit = j >= 0 and ious[i, j] >= iou_threshold and j not in matched
+                if hit:
+                    matched.add(j)
+                    if cand[i, 4] >= recall_conf:
+                        hits += 1
+                tp.append(hit)
+                conf.append(cand[i, 4])
+        ap50 = average_precision(tp, np.array(conf), total)
+        report[name] = {"ap50": ap50, "recall": hits / total if total else float('nan'), "instances": total}
+    return report
+
+
+def labeled_metrics(model, data, imgsz, classes):
+    """
+    per class AP50, mAP50-95 and recall from ultralytics val on a labeled dataset yaml
+    """
+    metrics = model.val(data=data, imgsz=imgsz, batch=1, plots=False, verbose=False)
+    report = {}
+    for i, cls in enumerate(metrics.box.ap_class_index):
+        name = metrics.names[int(cls)]
+        if name in classes:
+            precision, recall, ap50, ap = metrics.box.class_result(i)
+            report[name] = {"ap50": float(ap50), "map50_95": float(ap), "recall": float(recall)}
+    return report
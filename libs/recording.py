@@ -0,0 +1,226 @@
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from libs import metrics
+from libs.render import BoxRenderer
+
+IDLE_TIMEOUT = 10
+
+
+class SegmentWriter(object):
+    def __init__(self, path, fps, size, started):
+        self.path = path
+        self.size = size
+        self.started = started
+        self.frames = 0
+        self.last_write = time.time()
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+
+
+class SegmentRecorder(object):
+    """
+    evidence recording off the inference path: submit() only enqueues, an
+    encoder thread draws overlays and writes per camera MP4 segments of
+    segment_seconds, rotating and deleting old segments by age and total
+    size. Frames are repeated or dropped by timestamp so every segment
+    plays back in wall-clock time at fps. With events=True only the time
+    around violations is kept, starting preroll seconds before the first
+    violating frame; frames must not be modified after they are submitted.
+    The encoder thread starts with the first frame, so inference processes
+    can still be forked before it exists
+    """
+
+    def __init__(self, directory, fps=20, segment_seconds=60, max_age=24 * 3600,
+                 max_bytes=10 * 1024 ** 3, events=False, preroll=5.0, postroll=10.0, queue_size=64):
+        self.directory = directory
+        self.fps = fps
+        self.interval = 1.0 / fps
+        self.segment_seconds = segment_seconds
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.events = events
+        self.preroll = preroll
+        self.postroll = postroll
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.renderer = BoxRenderer()
+        self.lock = threading.Lock()
+        self.last_submit = {}
+        self.pending_violation = set()
+        self.writers = {}
+        self.prerolls = {}
+        self.active_until = {}
+        self.files = deque()
+        self.total_bytes = 0
+        self.stats = {"written": 0, "dropped": 0, "segments": 0, "deleted": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+        self._enforce_retention()
+        self.thread = None
+
+    def _scan(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.mp4') and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, path, stat.st_size))
+        for mtime, path, size in sorted(entries):
+            self.files.append((path, size, mtime))
+            self.total_bytes += size
+
+    def submit(self, camera, frame, timestamp=None, boxes=None, violation=False):
+        """
+        queue a frame, boxes are drawn on a copy by the encoder thread;
+        frames above fps are thinned out, a thinned violation is carried
+        over to the next frame that gets through
+        """
+        now = time.time() if timestamp is None else timestamp
+        # 10% slack so a camera sending at exactly fps is not thinned by jitter
+        if now - self.last_submit.get(camera, 0) < self.interval * 0.9:
+            if violation:
+                self.pending_violation.add(camera)
+            return False
+        self.last_submit[camera] = now
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, daemon=True)
+                    self.thread.start()
+        if camera in self.pending_violation:
+            self.pending_violation.discard(camera)
+            violation = True
+        try:
+            self.queue.put_nowait((camera, frame, now, boxes, violation))
+        except queue.Full:
+            with self.lock:
+                self.stats["dropped"] += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                camera, frame, timestamp, boxes, violation = self.queue.get(timeout=1)
+            except queue.Empty:
+                self._close_idle()
+                self._enforce_retention()
+                continue
+            start = time.perf_counter()
+            if boxes:
+                frame = self.renderer.draw(frame.copy(), boxes)
+            if self.events:
+                self._record_event(camera, frame, timestamp, violation)
+            else:
+                self._write(camera, frame, timestamp)
+            metrics.observe('record', time.perf_counter() - start)
+            self._close_idle()
+
+    def _record_event(self, camera, frame, timestamp, violation):
+        preroll = self.prerolls.get(camera)
+        if preroll is None:
+            preroll = self.prerolls[camera] = deque(maxlen=max(1, int(self.preroll * self.fps)))
+        if violation:
+            self.active_until[camera] = timestamp + self.postroll
+        if timestamp > self.active_until.get(camera, 0):
+            self._close(camera)
+            # jpeg keeps the pre-roll of a 1080p camera in tens of MB instead of hundreds
+            ret, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 85])
+            if ret:
+                preroll.append((buffer, timestamp))
+            return
+        while preroll:
+            buffer, preroll_timestamp = preroll.popleft()
+            self._write(camera, cv2.imdecode(buffer, cv2.IMREAD_COLOR), preroll_timestamp)
+        self._write(camera, frame, timestamp)
+
+    def _write(self, camera, frame, timestamp):
+        size = (frame.shape[1], frame.shape[0])
+        segment = self.writers.get(camera)
+        if segment is not None and (timestamp - segment.started >= self.segment_seconds or segment.size != size
+                                    or timestamp - segment.started - segment.frames * self.interval > IDLE_TIMEOUT):
+            # a long gap starts a new segment instead of freezing on one frame
+            self._close(camera)
+            segment = None
+        if segment is None:
+            safe_camera = re.sub(r'[^A-Za-z0-9_.-]', '_', camera)
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))
+            path = os.path.join(self.directory, f"{safe_camera}_{stamp}_{int(timestamp * 1000) % 1000:03d}.mp4")
+            segment = self.writers[camera] = SegmentWriter(path, self.fps, size, timestamp)
+            if not segment.writer.isOpened():
+                print(f"Error opening video writer for {path}")
+        # frame slots of this segment up to and including timestamp: the frame fills
+        # every slot since the last one written, or is dropped when it is early
+        due = int((timestamp - segment.started) * self.fps) + 1 - segment.frames
+        if due <= 0:
+            return
+        frame = np.ascontiguousarray(frame)
+        for _ in range(due):
+            segment.writer.write(frame)
+        segment.frames += due
+        segment.last_write = time.time()
+        with self.lock:
+            self.stats["written"] += 1
+
+    def _close(self, camera):
+        segment = self.writers.pop(camera, None)
+        if segment is None:
+            return
+        segment.writer.release()
+        try:
+            size = os.path.getsize(segment.path)
+        except OSError:
+            return
+        with self.lock:
+            self.files.append((segment.path, size, time.time()))
+            self.total_bytes += size
+            self.stats["segments"] += 1
+        self._enforce_retention()
+
+    def _close_idle(self):
+        # camera went away, finish its segment so it becomes playable
+        now = time.time()
+        for camera, segment in list(self.writers.items()):
+            if now - segment.last_write > IDLE_TIMEOUT:
+                self._close(camera)
+
+    def _enforce_retention(self):
+        evict = []
+        cutoff = time.time() - self.max_age
+        with self.lock:
+            while self.files and (self.total_bytes > self.max_bytes or self.files[0][2] < cutoff):
+                path, size, _ = self.files.popleft()
+                self.total_bytes -= size
+                evict.append(path)
+                self.stats["deleted"] += 1
+        for path in evict:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def snapshot(self):
+        with self.lock:
+            data = dict(self.stats)
+            data["bytes"] = self.total_bytes
+            data["files"] = len(self.files)
+        data["recording"] = sorted(self.writers)
+        data["queue"] = self.queue.qsize()
+        return data
+
+    def collect(self):
+        data = self.snapshot()
+        return [
+            ("ppe_recording_queue_depth", "gauge", "Frames waiting for the recording encoder",
+             [({}, data["queue"])]),
+            ("ppe_recording_frames_total", "counter", "Recorded frames by outcome",
+             [({"outcome": "written"}, data["written"]), ({"outcome": "dropped"}, data["dropped"])]),
+            ("ppe_recording_bytes", "gauge", "Bytes used by finished recording segments",
+             [({}, data["bytes"])]),
+        ]
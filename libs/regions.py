@@ -0,0 +1,174 @@
+import json
+import math
+
+import cv2
+import numpy as np
+
+from libs.boxes import nms
+from libs.preprocess import PAD_COLOR, Letterbox
+
+# defaults for every camera, override per camera with --region-config
+REGION_DEFAULTS = {
+    # polygons [[x, y], ...] in fractions of frame width and height, null infers the whole frame
+    "roi": None,
+    # split the ROI into overlapping tiles instead of letterboxing it whole
+    "tiles": False,
+    # tile side in frame pixels, null uses imgsz so tiles are inferred at full resolution
+    "tile_size": None,
+    # fraction of a tile shared with its neighbour
+    "overlap": 0.2,
+    # boxes of one class from different tiles are merged above this IoU ...
+    "nms_iou": 0.5,
+    # ... or when this much of the smaller one lies inside the other
+    "nms_containment": 0.8,
+}
+
+
+def load_region_config(path):
+    """
+    json file {"defaults": {...}, "cameras": {"<name>": {...}}} with keys from REGION_DEFAULTS
+    """
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def region_settings(config, camera, **overrides):
+    settings = dict(REGION_DEFAULTS)
+    settings.update((k, v) for k, v in overrides.items() if v is not None)
+    settings.update(config.get("defaults", {}))
+    settings.update(config.get("cameras", {}).get(camera, {}))
+    return settings
+
+
+def tile_starts(length, tile, overlap):
+    # evenly spaced windows covering length, neighbours sharing at least overlap of a tile
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - tile) / (tile * (1 - overlap))) + 1
+    return [int(round(i * (length - tile) / (count - 1))) for i in range(count)]
+
+
+def decode_target(settings, imgsz):
+    """
+    long side a camera's frames may be decoded down to: imgsz for whole
+    frames, more for an ROI crop so the crop itself still covers imgsz,
+    None (full resolution) for tiles, which are cut in frame pixels
+    """
+    if settings["tiles"]:
+        return None
+    if not settings["roi"]:
+        return imgsz
+    points = np.concatenate([np.asarray(polygon, dtype=np.float64) for polygon in settings["roi"]])
+    extent = float((np.clip(points.max(axis=0), 0, 1) - np.clip(points.min(axis=0), 0, 1)).min())
+    return int(math.ceil(imgsz / extent)) if extent > 0 else None
+
+
+class RegionLayout(object):
+    """
+    what of a camera frame goes through the model: the bounding box of the
+    ROI polygons, with everything outside them painted over, letterboxed
+    whole or cut into overlapping tiles. restore() puts the per tile results
+    back together on the original frame, keeps boxes centred inside the ROI
+    and merges duplicates from overlapping tiles
+    """
+
+    def __init__(self, imgsz=640, roi=None, tiles=False, tile_size=None, overlap=0.2,
+                 nms_iou=0.5, nms_containment=0.8):
+        self.imgsz = imgsz
+        self.roi = roi
+        self.tiles = tiles
+        self.tile_size = tile_size or imgsz
+        self.overlap = min(max(overlap, 0.0), 0.9)
+        self.nms_iou = nms_iou
+        self.nms_containment = nms_containment
+        self.source_shape = None
+        self.crop = None
+        self.inside = None
+        self.masked = None
+        self.windows = []
+        self.letterboxes = []
+
+    def _layout(self, shape):
+        height, width = shape
+        self.source_shape = shape
+        self.crop = (0, 0, width, height)
+        self.inside = None
+        self.masked = None
+        if self.roi:
+            polygons = [np.round(np.array(polygon, dtype=np.float64) * (width, height)).astype(np.int32)
+                        for polygon in self.roi]
+            mask = np.zeros(shape, dtype=np.uint8)
+            cv2.fillPoly(mask, polygons, 1)
+            ys, xs = np.nonzero(mask)
+            if len(xs):
+                x0, y0, x1, y1 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+                self.crop = (int(x0), int(y0), int(x1), int(y1))
+                self.inside = mask[y0:y1, x0:x1].astype(bool)
+                if not self.inside.all():
+                    self.masked = np.full((y1 - y0, x1 - x0, 3), PAD_COLOR, dtype=np.uint8)
+            else:
+                print(f"[regions] ROI {self.roi} is outside the {width}x{height} frame, inferring all of it")
+        x0, y0, x1, y1 = self.crop
+        if self.tiles:
+            tile_w, tile_h = min(self.tile_size, x1 - x0), min(self.tile_size, y1 - y0)
+            windows = [(x, y, x + tile_w, y + tile_h)
+                       for y in tile_starts(y1 - y0, tile_h, self.overlap)
+                       for x in tile_starts(x1 - x0, tile_w, self.overlap)]
+            if self.inside is not None:
+                # tiles that only see painted over pixels are not worth a forward pass
+                windows = [w for w in windows if self.inside[w[1]:w[3], w[0]:w[2]].any()]
+        else:
+            windows = [(0, 0, x1 - x0, y1 - y0)]
+        self.windows = windows
+        self.letterboxes = [Letterbox(self.imgsz) for _ in windows]
+
+    def __call__(self, frame):
+        """
+        returns one canvas per tile, they are overwritten by the next call
+        """
+        if frame.shape[:2] != self.source_shape:
+            self._layout(frame.shape[:2])
+        x0, y0, x1, y1 = self.crop
+        crop = frame[y0:y1, x0:x1]
+        if self.masked is not None:
+            # pixels outside the polygons keep the pad colour from _layout
+            np.copyto(self.masked, crop, where=self.inside[..., None])
+            crop = self.masked
+        return [letterbox(crop[wy0:wy1, wx0:wx1])
+                for (wx0, wy0, wx1, wy1), letterbox in zip(self.windows, self.letterboxes)]
+
+    def restore(self, results, frame):
+        """
+        one ultralytics result per tile -> a single result on the original
+        frame, boxes rescaled and offset, so tracking and plotting use full size
+        """
+        import torch
+
+        x0, y0 = self.crop[:2]
+        parts = []
+        for result, (wx0, wy0, _, _), letterbox in zip(results, self.windows, self.letterboxes):
+            data = result.boxes.data.clone()
+            letterbox.unmap(data)
+            data[:, [0, 2]] += x0 + wx0
+            data[:, [1, 3]] += y0 + wy0
+            parts.append(data)
+        data = torch.cat(parts) if len(parts) > 1 else parts[0]
+        if len(data) and (self.inside is not None or len(parts) > 1):
+            boxes = data.cpu().numpy()
+            keep = np.arange(len(boxes))
+            if self.inside is not None:
+                centers = ((boxes[:, :2] + boxes[:, 2:4]) / 2 - (x0, y0)).astype(int)
+                height, width = self.inside.shape
+                cx, cy = np.clip(centers[:, 0], 0, width - 1), np.clip(centers[:, 1], 0, height - 1)
+                keep = keep[self.inside[cy, cx]]
+            if len(parts) > 1 and len(keep):
+                keep = keep[nms(boxes[keep, :4], boxes[keep, 4], boxes[keep, 5],
+                                self.nms_iou, self.nms_containment)]
+            data = data[torch.as_tensor(np.sort(keep), dtype=torch.long, device=data.device)]
+        result = results[0]
+        result.orig_img = frame
+        result.orig_shape = frame.shape[:2]
+        result.update(boxes=data)
+        return result
@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+
+RENDERERS = ('fast', 'ultralytics')
+
+# BGR, same hues as the ultralytics palette
+PALETTE = [
+    (56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+    (10, 249, 72), (23, 204, 146), (134, 219, 61), (52, 147, 26), (187, 212, 0),
+    (168, 153, 44), (255, 194, 0), (147, 69, 52), (255, 115, 100), (236, 24, 0),
+    (255, 56, 132), (133, 0, 82), (255, 56, 203), (200, 149, 255), (199, 55, 255),
+]
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+class BoxRenderer(object):
+    """
+    lightweight stand-in for result.plot(): draws the boxes dicts produced by
+    the router straight onto the frame, without a Results object or a copy
+    """
+
+    def __init__(self, thickness=2, font_scale=0.5):
+        self.thickness = thickness
+        self.font_scale = font_scale
+        self.colors = {}
+
+    def _color(self, name):
+        color = self.colors.get(name)
+        if color is None:
+            color = self.colors[name] = PALETTE[len(self.colors) % len(PALETTE)]
+        return color
+
+    def draw(self, frame, boxes):
+        """
+        draws in place and returns frame
+        """
+        if not boxes:
+            return frame
+        height, width = frame.shape[:2]
+        xyxy = np.array([box["xyxy"] for box in boxes], dtype=np.float32).round().astype(np.int32)
+        np.clip(xyxy[:, 0::2], 0, width - 1, out=xyxy[:, 0::2])
+        np.clip(xyxy[:, 1::2], 0, height - 1, out=xyxy[:, 1::2])
+        for (x1, y1, x2, y2), box in zip(xyxy.tolist(), boxes):
+            color = self._color(box["class"])
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, self.thickness)
+            label = "{} {:.2f}".format(box["class"], box["confidence"])
+            if box.get("track_id") is not None:
+                label = "id:{} {}".format(box["track_id"], label)
+            (text_w, text_h), _ = cv2.getTextSize(label, FONT, self.font_scale, 1)
+            # label above the box, or inside it at the top edge of the frame
+            top = y1 - text_h - 4 if y1 - text_h - 4 >= 0 else y1
+            cv2.rectangle(frame, (x1, top), (x1 + text_w + 2, top + text_h + 4), color, -1)
+            cv2.putText(frame, label, (x1 + 1, top + text_h + 1), FONT, self.font_scale,
+                        (255, 255, 255), 1, cv2.LINE_AA)
+        return frame
@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+KEEPALIVE_INTERVAL = 15
+
+
+def detection_signature(detections):
+    # what a result shows, ignoring confidence jitter: classes and track ids per bucket
+    return tuple((bucket, tuple(sorted((d.get("track_id", -1), d["class"]) for d in items)))
+                 for bucket, items in sorted(detections.items()))
+
+
+class ResultWriter(object):
+    """
+    background writer that persists the newest result to a json file,
+    results published while a write is in progress are coalesced; the
+    thread starts with the first result, so inference processes can still
+    be forked before it exists
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = None
+        self.thread = None
+        self.ready = threading.Condition()
+
+    def submit(self, entry):
+        with self.ready:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.pending = entry
+            self.ready.notify()
+
+    def _run(self):
+        while True:
+            with self.ready:
+                self.ready.wait_for(lambda: self.pending is not None)
+                entry, self.pending = self.pending, None
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Error writing results to {self.path}: {e}")
+
+
+class ResultSubscriber(object):
+    """
+    bounded buffer of results for one push client; when the client falls
+    behind the oldest results are dropped and counted
+    """
+
+    def __init__(self, camera=None, changed_only=False, queue_size=256):
+        self.camera = camera
+        self.changed_only = changed_only
+        self.queue = deque(maxlen=queue_size)
+        self.signatures = {}
+        self.dropped = 0
+        self.ready = threading.Condition()
+
+    def offer(self, entry, signature):
+        if self.camera is not None and entry["camera"] != self.camera:
+            return
+        if self.changed_only:
+            if self.signatures.get(entry["camera"]) == signature:
+                return
+            self.signatures[entry["camera"]] = signature
+        with self.ready:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(entry)
+            self.ready.notify()
+
+    def get(self, timeout=None):
+        """
+        returns (entries, dropped since the last call), entries may be empty on timeout
+        """
+        with self.ready:
+            self.ready.wait_for(lambda: self.queue, timeout)
+            entries = list(self.queue)
+            self.queue.clear()
+            dropped, self.dropped = self.dropped, 0
+        return entries, dropped
+
+
+def sse_stream(source, subscriber, event):
+    """
+    Server-Sent Events for a subscriber of source: one event per entry with
+    the seq as id, 'overflow' when entries were dropped for this client, and
+    a comment line as keepalive
+    """
+    try:
+        yield b'retry: 2000\n\n'
+        while True:
+            entries, dropped = subscriber.get(timeout=KEEPALIVE_INTERVAL)
+            if dropped:
+                yield ('event: overflow\ndata: %s\n\n' % json.dumps({"dropped": dropped})).encode()
+            if not entries:
+                yield b': keepalive\n\n'
+                continue
+            yield ''.join('id: %d\nevent: %s\ndata: %s\n\n' % (entry["seq"], event, json.dumps(entry))
+                          for entry in entries).encode()
+    finally:
+        source.unsubscribe(subscriber)
+
+
+class ResultStore(object):
+    """
+    thread-safe ring buffer of recent detection results per camera; every
+    result gets a sequence number that increases across all cameras
+    """
+
+    def __init__(self, history=100, persist_path=None):
+        self.history = history
+        self.results = {}
+        self.seq = 0
+        self.ready = threading.Condition()
+        self.subscribers = set()
+        self.writer = ResultWriter(persist_path) if persist_path else None
+
+    def publish(self, camera, detections, timestamp=None, frame_seq=None, frame_timestamp=None):
+        with self.ready:
+            self.seq += 1
+            entry = {
+                "seq": self.seq,
+                "camera": camera,
+                "timestamp": time.time() if timestamp is None else timestamp,
+                "frame_seq": frame_seq,
+                "frame_timestamp": frame_timestamp,
+                "detections": detections,
+            }
+            if camera not in self.results:
+                self.results[camera] = deque(maxlen=self.history)
+            self.results[camera].append(entry)
+            self.ready.notify_all()
+            # offered under the lock so every subscriber sees seq in order, even with
+            # several inference threads publishing; an offer is a bounded append
+            if self.subscribers:
+                signature = detection_signature(detections)
+                for subscriber in self.subscribers:
+                    subscriber.offer(entry, signature)
+        if self.writer is not None:
+            self.writer.submit(entry)
+        return entry
+
+    def subscribe(self, camera=None, changed_only=False, since=None, queue_size=256):
+        """
+        push subscription; with since, buffered results newer than that seq are replayed first
+        """
+        subscriber = ResultSubscriber(camera, changed_only, queue_size)
+        with self.ready:
+            # replay under the lock so no new result slips in ahead of the backlog
+            for entry in self.since(since, camera) if since is not None else []:
+                subscriber.offer(entry, detection_signature(entry["detections"]))
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.ready:
+            self.subscribers.discard(subscriber)
+
+    def stream(self, camera=None, changed_only=False, since=None):
+        return sse_stream(self, self.subscribe(camera, changed_only, since), 'result')
+
+    def latest(self, camera=None):
+        with self.ready:
+            if camera is not None:
+                results = self.results.get(camera)
+                return results[-1] if results else None
+            entries = [results[-1] for results in self.results.values() if results]
+        return max(entries, key=lambda entry: entry["seq"]) if entries else None
+
+    def since(self, seq, camera=None):
+        with self.ready:
+            if camera is not None:
+                buffers = [self.results.get(camera, ())]
+            else:
+                buffers = list(self.results.values())
+            entries = [entry for results in buffers for entry in results if entry["seq"] > seq]
+        return sorted(entries, key=lambda entry: entry["seq"])
@@ -0,0 +1,80 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _process_started():
+    # monotonic time the process was started, so interpreter and import time are counted too
+    try:
+        with open('/proc/self/stat') as f:
+            ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.monotonic() - (uptime - ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+
+
+class Startup(object):
+    """
+    startup phase timings and readiness: every phase is logged when it ends,
+    mark_ready() logs the time from process start until cameras are accepted
+    """
+
+    def __init__(self):
+        self.started = _process_started()
+        self.lock = threading.Lock()
+        self.phases = []
+        self.current = None
+        self.ready = False
+        self.ready_after = None
+        self.error = None
+        self._record('imports', self.started)
+
+    def _record(self, name, start):
+        now = time.monotonic()
+        with self.lock:
+            self.phases.append((name, now - start))
+        print(f"[startup] {name} {now - start:.2f}s ({now - self.started:.2f}s since start)", flush=True)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        self.current = name
+        try:
+            yield
+        finally:
+            self.current = None
+            self._record(name, start)
+
+    def mark_ready(self):
+        self.ready_after = time.monotonic() - self.started
+        self.ready = True
+        print(f"[startup] ready, {self.ready_after:.2f}s from process start to first inference", flush=True)
+
+    def fail(self, error):
+        self.error = str(error)
+        print(f"[startup] failed during {self.current or 'startup'}: {error}", flush=True)
+
+    def snapshot(self):
+        with self.lock:
+            phases = dict(self.phases)
+        return {
+            "ready": self.ready,
+            "phase": self.current,
+            "phases": {name: round(seconds, 3) for name, seconds in phases.items()},
+            "ready_after": round(self.ready_after, 3) if self.ready_after is not None else None,
+            "uptime": round(time.monotonic() - self.started, 3),
+            "error": self.error,
+        }
+
+    def collect(self):
+        with self.lock:
+            phases = list(self.phases)
+        return [
+            ("ppe_startup_phase_seconds", "gauge", "Time spent in each startup phase",
+             [({"phase": name}, round(seconds, 6)) for name, seconds in phases]),
+            ("ppe_ready", "gauge", "Whether the model is warm and cameras are accepted",
+             [({}, int(self.ready))]),
+        ]
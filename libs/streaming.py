@@ -0,0 +1,112 @@
+import queue
+import threading
+import time
+
+import cv2
+
+from libs import metrics
+
+KEEPALIVE_INTERVAL = 5
+
+
+class MjpegBroadcaster(object):
+    """
+    encodes each new frame of a FrameSlot once and fans the jpeg out to
+    every /video_feed subscriber; slow viewers lose frames instead of
+    blocking, and the encoder thread exits when nobody is watching.
+    wants_frame() tells the producer whether anyone needs an annotated
+    frame right now, at the fastest rate a subscriber asked for
+    """
+
+    def __init__(self, frame_slot, quality=95, queue_size=2):
+        self.frame_slot = frame_slot
+        self.params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        self.queue_size = queue_size
+        # subscriber queue -> minimum seconds between frames
+        self.subscribers = {}
+        self.lock = threading.Lock()
+        self.last_wanted = 0.0
+        self.thread = None
+        self.encoded = 0
+        self.dropped = 0
+
+    @property
+    def viewers(self):
+        with self.lock:
+            return len(self.subscribers)
+
+    def wants_frame(self, now=None):
+        with self.lock:
+            if not self.subscribers:
+                return False
+            interval = min(self.subscribers.values())
+            now = time.monotonic() if now is None else now
+            if now - self.last_wanted < interval:
+                return False
+            self.last_wanted = now
+            return True
+
+    def subscribe(self, fps=None):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers[subscriber] = 1.0 / fps if fps else 0.0
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.pop(subscriber, None)
+
+    def _run(self):
+        seq = self.frame_slot.seq
+        frame = None
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+            seq, frame, timestamp = self.frame_slot.wait(seq, timeout=1, out=frame)
+            if frame is None:
+                continue
+            start = time.perf_counter()
+            ret, buffer = cv2.imencode('.jpg', frame, self.params)
+            metrics.observe('jpeg_encode', time.perf_counter() - start)
+            if not ret:
+                print("Failed to encode frame")
+                continue
+            # X-Timestamp carries the camera's capture time for latency measurements
+            headers = b'Content-Type: image/jpeg\r\nContent-Length: %d\r\n' % len(buffer)
+            if timestamp is not None:
+                headers += b'X-Timestamp: %.6f\r\n' % timestamp
+            chunk = b'--frame\r\n' + headers + b'\r\n' + buffer.tobytes() + b'\r\n'
+            self.encoded += 1
+            with self.lock:
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(chunk)
+                except queue.Full:
+                    # drop the oldest queued jpeg for this viewer
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+                    subscriber.put_nowait(chunk)
+                    self.dropped += 1
+
+    def stream(self, fps=None):
+        subscriber = self.subscribe(fps)
+        chunk = None
+        try:
+            while True:
+                try:
+                    chunk = subscriber.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    # resend the last jpeg now and then so dead viewers get noticed
+                    if chunk is None:
+                        continue
+                yield chunk
+        finally:
+            self.unsubscribe(subscriber)
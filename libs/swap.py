@@ -0,0 +1,187 @@
+import gc
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# frames after a swap that still count towards its latency blip
+BLIP_FRAMES = 20
+DRAIN_TIMEOUT = 60
+
+
+def names_compatible(old, new):
+    # trackers survive a swap as long as every class id they have seen keeps its meaning
+    return old is None or all(new.get(cls) == name for cls, name in old.items())
+
+
+class ModelSlot(object):
+    """
+    the model inference runs on, replaceable between batches: use() pins the
+    current model for one batch, swap() installs a new one for the next
+    batch and returns once no batch runs on the old one, so it is only
+    freed after the frames in flight are done. epoch changes when the new
+    model's class ids mean something else, trackers are rebuilt then
+    """
+
+    def __init__(self):
+        self.model = None
+        self.path = None
+        self.names = None
+        self.generation = 0
+        self.epoch = 0
+        self.in_flight = {}
+        self.ready = threading.Condition()
+
+    @contextmanager
+    def use(self):
+        """
+        yields (model, epoch)
+        """
+        with self.ready:
+            if self.model is None:
+                raise RuntimeError("no model loaded")
+            model, generation, epoch = self.model, self.generation, self.epoch
+            self.in_flight[generation] = self.in_flight.get(generation, 0) + 1
+        try:
+            yield model, epoch
+        finally:
+            with self.ready:
+                self.in_flight[generation] -= 1
+                if not self.in_flight[generation]:
+                    del self.in_flight[generation]
+                    self.ready.notify_all()
+
+    def swap(self, model, path=None, timeout=DRAIN_TIMEOUT):
+        names = dict(model.names)
+        with self.ready:
+            previous = self.generation
+            compatible = names_compatible(self.names, names)
+            self.model, self.path, self.names = model, path, names
+            self.generation += 1
+            if not compatible:
+                self.epoch += 1
+            start = time.monotonic()
+            drained = self.ready.wait_for(lambda: all(g > previous for g in self.in_flight), timeout)
+        drain = time.monotonic() - start
+        # the old model's last reference went with its last batch
+        gc.collect()
+        return {"compatible": compatible, "drain": drain, "drained": drained}
+
+    def replace(self, path, load, warm=None):
+        """
+        load(path) and warm(model) the new model while the current one keeps
+        serving, then swap it in; returns the time taken by each step
+        """
+        start = time.monotonic()
+        model = load(path)
+        loaded = time.monotonic()
+        if warm is not None:
+            warm(model)
+        warmed = time.monotonic()
+        stats = self.swap(model, path)
+        stats.update(load=loaded - start, warmup=warmed - loaded, generation=self.generation, names=self.names)
+        return stats
+
+
+class ModelSwapper(object):
+    """
+    runs one model swap at a time on a background thread and measures it;
+    swap(path) does the work and returns its stats. The latency blip is the
+    worst frame latency seen from the start of a swap until BLIP_FRAMES
+    frames after it, compared with the average latency before it
+    """
+
+    def __init__(self, swap, path=None, history=10):
+        self.swap = swap
+        self.path = path
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.running = None
+        self.history = deque(maxlen=history)
+        self.latency = None
+        self.window = None
+
+    def observe(self, seconds):
+        with self.lock:
+            window = self.window
+            if window is None:
+                self.latency = seconds if self.latency is None else self.latency + 0.05 * (seconds - self.latency)
+                return
+            window["max_latency"] = max(window["max_latency"], seconds)
+            if window.get("finished"):
+                window["frames_after"] += 1
+                if window["frames_after"] >= BLIP_FRAMES:
+                    self._close_window()
+
+    def _close_window(self):
+        window, self.window = self.window, None
+        window.pop("finished", None)
+        entry = window.pop("entry")
+        baseline = window["baseline_latency"]
+        entry["baseline_latency"] = baseline
+        entry["max_latency"] = window["max_latency"]
+        entry["blip"] = window["max_latency"] - baseline if baseline is not None else None
+
+    def start(self, path):
+        """
+        begins a swap to path, False when one is already running
+        """
+        with self.lock:
+            if self.running is not None:
+                return False
+            self.running = path
+            if self.window is not None:
+                self._close_window()
+            entry = {"path": path, "started": time.time(), "status": "running"}
+            self.history.append(entry)
+            self.window = {"entry": entry, "baseline_latency": self.latency, "max_latency": 0.0,
+                           "frames_after": 0}
+        threading.Thread(target=self._run, args=(path, entry), daemon=True).start()
+        return True
+
+    def _run(self, path, entry):
+        print(f"[swap] loading {path}", flush=True)
+        start = time.monotonic()
+        try:
+            stats = self.swap(path)
+        except Exception as e:
+            print(f"[swap] {path} failed - exception {e}", flush=True)
+            with self.lock:
+                entry.update(status="failed", error=str(e), duration=time.monotonic() - start)
+                self.running = None
+                self.window = None
+            return
+        duration = time.monotonic() - start
+        with self.lock:
+            entry.update(stats, status="done", duration=duration)
+            self.path = path
+            self.generation += 1
+            self.running = None
+            if self.window is not None:
+                self.window["finished"] = True
+        print(f"[swap] {path} in service after {duration:.2f}s", flush=True)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "path": self.path,
+                "generation": self.generation,
+                "swapping": self.running,
+                "latency": self.latency,
+                "history": [dict(entry) for entry in self.history],
+            }
+
+    def collect(self):
+        with self.lock:
+            last = next((entry for entry in reversed(self.history) if entry["status"] == "done"), None)
+            generation = self.generation
+        samples = []
+        if last is not None:
+            samples = [({"step": step}, round(last[step], 6))
+                       for step in ("load", "warmup", "drain", "duration") if last.get(step) is not None]
+        return [
+            ("ppe_model_generation", "gauge", "Models swapped in since startup",
+             [({}, generation)]),
+            ("ppe_model_swap_seconds", "gauge", "Time taken by each step of the last model swap",
+             samples),
+        ]
@@ -0,0 +1,46 @@
+TRACKERS = ('bytetrack', 'botsort')
+
+# model.track() lowers conf to this so the tracker sees low-score boxes
+TRACK_CONF = 0.1
+
+
+class CameraTracker(object):
+    """
+    owns the tracker state of one camera, mirrors what model.track(persist=True)
+    does for a single stream but keeps cameras from sharing track ids
+    """
+
+    def __init__(self, config='bytetrack.yaml'):
+        # ultralytics and torch are imported when the first camera shows up (or at warm-up)
+        from ultralytics.utils import IterableSimpleNamespace
+        from ultralytics.utils.checks import check_yaml
+        from ultralytics.trackers.byte_tracker import BYTETracker
+        from ultralytics.trackers.bot_sort import BOTSORT
+        try:
+            from ultralytics.utils import YAML
+            load_yaml = YAML.load
+        except ImportError:
+            from ultralytics.utils import yaml_load as load_yaml
+
+        self.config = config
+        cfg = IterableSimpleNamespace(**load_yaml(check_yaml(config)))
+        if cfg.tracker_type not in TRACKERS:
+            raise ValueError(f"Unknown tracker_type {cfg.tracker_type}, expected one of {TRACKERS}")
+        self.tracker = (BYTETracker if cfg.tracker_type == 'bytetrack' else BOTSORT)(args=cfg)
+
+    def update(self, result):
+        import torch
+
+        det = result.boxes.cpu().numpy()
+        if len(det) == 0:
+            return result
+        tracks = self.tracker.update(det, result.orig_img)
+        if len(tracks) == 0:
+            return result
+        idx = tracks[:, -1].astype(int)
+        result = result[idx]
+        result.update(boxes=torch.as_tensor(tracks[:, :-1]))
+        return result
+
+    def reset(self):
+        self.tracker.reset()
@@ -0,0 +1,243 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from libs import metrics
+from libs.cameras import QueuedFrame
+from libs.framebuffer import SharedFrameSlot
+
+REPLY_TIMEOUT = 1
+# first inbox message of a worker, it sets up once the parent is ready for it
+START = 'start'
+
+
+def _pin(index, threads):
+    # give every worker its own block of cores when there are enough of them
+    try:
+        cores = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return None
+    if len(cores) < (index + 1) * threads:
+        return None
+    mine = cores[index * threads:(index + 1) * threads]
+    os.sched_setaffinity(0, mine)
+    return mine
+
+
+def _control(index, handler, message, control):
+    try:
+        control.put(("ok", handler(message)))
+    except Exception as e:
+        print(f"[worker {index}] Control message failed - exception {e}")
+        control.put(("error", str(e)))
+
+
+def _worker_main(index, threads, setup, slots, inbox, outbox, control):
+    import torch
+
+    # forked early, wait for start() before loading anything
+    if inbox.get() is None:
+        return
+    cores = _pin(index, threads)
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(1)
+    # forget the stage timings inherited from the parent
+    metrics.drain()
+    run_batch = setup(index)
+    handler = None
+    if isinstance(run_batch, tuple):
+        run_batch, handler = run_batch
+    print(f"[worker {index}] pid {os.getpid()}, {threads} torch threads, cores {cores}", flush=True)
+    outbox.put(None)
+    frames = [None] * len(slots)
+    while True:
+        jobs = inbox.get()
+        if jobs is None:
+            return
+        if isinstance(jobs, tuple):
+            # handled next to inference, batches keep running meanwhile
+            threading.Thread(target=_control, args=(index, handler, jobs, control), daemon=True).start()
+            continue
+        items = []
+        for slot, slot_seq, camera, seq, timestamp, enqueued, annotate in jobs:
+            _, frames[slot], _ = slots[slot].wait(slot_seq - 1, timeout=REPLY_TIMEOUT, out=frames[slot])
+            items.append((camera, QueuedFrame(frames[slot], seq, timestamp, enqueued), annotate))
+        try:
+            outputs = run_batch(items)
+        except Exception as e:
+            print(f"[worker {index}] Inference failed - exception {e}")
+            outputs = [None] * len(items)
+        replies = []
+        for (slot, _, _, _, timestamp, _, _), output in zip(jobs, outputs):
+            if output is None:
+                replies.append((slot, None, None))
+                continue
+            payload, annotated = output
+            if annotated is None:
+                replies.append((slot, None, payload))
+                continue
+            # the annotated frame goes back through the slot the frame came in
+            replies.append((slot, slots[slot].publish(annotated, timestamp), payload))
+        outbox.put((replies, metrics.drain()))
+
+
+class InferenceWorker(object):
+    def __init__(self, context, index, threads, setup, slots, max_shape):
+        self.index = index
+        self.slots = [SharedFrameSlot(max_shape, condition=context.Condition()) for _ in range(slots)]
+        self.inbox = context.Queue()
+        self.outbox = context.Queue()
+        self.control = context.Queue()
+        self.process = context.Process(target=_worker_main, name=f"inference-{index}", daemon=True,
+                                       args=(index, threads, setup, self.slots, self.inbox, self.outbox,
+                                             self.control))
+        self.control_lock = threading.Lock()
+        self.cameras = set()
+        self.batches = 0
+        self.frames = 0
+        self.busy = 0.0
+
+    def _reply(self, box=None):
+        box = box or self.outbox
+        while True:
+            try:
+                return box.get(timeout=REPLY_TIMEOUT)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"inference worker {self.index} exited with {self.process.exitcode}")
+
+
+class InferencePool(object):
+    """
+    N inference processes, each with its own model copy and pinned torch
+    threads; a camera sticks to one worker so its tracker state lives in a
+    single process. Frames go out and annotated frames come back through
+    preallocated shared memory slots, only small metadata is pickled.
+    setup(index) runs inside the worker and returns
+    run_batch([(camera, QueuedFrame, annotate)]) -> [(payload, annotated frame or None) or None],
+    or (run_batch, handler) where handler(message) answers control() calls
+    on a thread of its own. launch() forks the processes, call it before
+    the parent starts any thread: a child inherits every lock in the state
+    it was in at fork time. start() then lets them set up and waits for them
+    """
+
+    def __init__(self, workers, setup, slots=4, max_shape=(1080, 1920, 3), threads=None):
+        # fork so setup and the script's functions need not be importable
+        context = multiprocessing.get_context('fork')
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.max_shape = tuple(max_shape)
+        self.lock = threading.Lock()
+        self.workers = [InferenceWorker(context, index, self.threads, setup, slots, self.max_shape)
+                        for index in range(workers)]
+        self.assignments = {}
+        self.launched = False
+
+    def launch(self):
+        for worker in self.workers:
+            worker.process.start()
+        self.launched = True
+
+    def start(self):
+        if not self.launched:
+            self.launch()
+        for worker in self.workers:
+            worker.inbox.put(START)
+        for worker in self.workers:
+            worker._reply()
+        print(f"[pool] {len(self.workers)} inference workers ready", flush=True)
+
+    def assign(self, camera):
+        with self.lock:
+            index = self.assignments.get(camera)
+            if index is None:
+                index = min(self.workers, key=lambda worker: len(worker.cameras)).index
+                self.assignments[camera] = index
+                self.workers[index].cameras.add(camera)
+            return index
+
+    def fit_ratio(self, shape):
+        """
+        scale a frame of this shape gets before it goes to a worker; the
+        boxes and annotated frame that come back are at that scale
+        """
+        height, width = shape[:2]
+        max_height, max_width = self.max_shape[:2]
+        if height <= max_height and width <= max_width:
+            return 1.0
+        return min(max_height / height, max_width / width)
+
+    def _fit(self, frame):
+        ratio = self.fit_ratio(frame.shape)
+        if ratio == 1.0:
+            return frame
+        height, width = frame.shape[:2]
+        size = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def submit(self, index, items):
+        """
+        run [(camera name, QueuedFrame, annotate)] on worker index and wait
+        for the outputs; only one thread may submit to a given worker at a time
+        """
+        worker = self.workers[index]
+        if len(items) > len(worker.slots):
+            raise ValueError(f"batch of {len(items)} exceeds {len(worker.slots)} worker slots")
+        start = time.monotonic()
+        jobs = []
+        for slot, (camera, job, annotate) in enumerate(items):
+            slot_seq = worker.slots[slot].publish(self._fit(job.frame), job.timestamp)
+            jobs.append((slot, slot_seq, camera, job.seq, job.timestamp, job.enqueued, annotate))
+        worker.inbox.put(jobs)
+        replies, stages = worker._reply()
+        metrics.merge(stages)
+        outputs = []
+        for slot, slot_seq, payload in replies:
+            if payload is None:
+                outputs.append(None)
+                continue
+            if slot_seq is None:
+                outputs.append((payload, None))
+                continue
+            _, annotated, _ = worker.slots[slot].wait(slot_seq - 1, timeout=REPLY_TIMEOUT)
+            outputs.append((payload, annotated))
+        worker.batches += 1
+        worker.frames += len(items)
+        worker.busy += time.monotonic() - start
+        return outputs
+
+    def control(self, index, message):
+        """
+        send a tuple message to the handler of worker index and wait for its
+        answer, raises RuntimeError when the handler failed
+        """
+        worker = self.workers[index]
+        with worker.control_lock:
+            worker.inbox.put(message)
+            status, reply = worker._reply(worker.control)
+        if status != "ok":
+            raise RuntimeError(f"inference worker {index}: {reply}")
+        return reply
+
+    def collect(self):
+        return [
+            ("ppe_worker_frames_total", "counter", "Frames run by each inference worker",
+             [({"worker": worker.index}, worker.frames) for worker in self.workers]),
+            ("ppe_worker_busy_seconds_total", "counter", "Time each inference worker spent on batches",
+             [({"worker": worker.index}, round(worker.busy, 6)) for worker in self.workers]),
+            ("ppe_worker_cameras", "gauge", "Cameras assigned to each inference worker",
+             [({"worker": worker.index}, len(worker.cameras)) for worker in self.workers]),
+            ("ppe_worker_alive", "gauge", "Whether the inference worker process is running",
+             [({"worker": worker.index}, int(worker.process.is_alive())) for worker in self.workers]),
+        ]
+
+    def close(self):
+        for worker in self.workers:
+            worker.inbox.put(None)
+        for worker in self.workers:
+            worker.process.join(timeout=5)
+            for slot in worker.slots:
+                slot.close()
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+
+import cv2
+import numpy as np
+
+from libs.backends import artifact_path, export_model, load_model
+from libs.quantization import agreement, labeled_metrics, list_images, predict_boxes, quantize_onnx
+
+parser = argparse.ArgumentParser(description="INT8 post-training quantization with an accuracy gate")
+parser.add_argument("--path", required=True, help="Path to the YOLOv8 .pt model")
+parser.add_argument("--calib-dir", default="/app/data/low_confidence_frames", help="Folder with calibration images")
+parser.add_argument("--calib-size", type=int, default=300, help="Images used for calibration")
+parser.add_argument("--eval-size", type=int, default=200, help="Held out images used for the accuracy check")
+parser.add_argument("--data", default=None,
+                    help="Labeled dataset yaml for the accuracy check, otherwise int8 is compared against fp32 predictions")
+parser.add_argument("--classes", default="helmet,head,safety-jacket", help="Classes the accuracy gate looks at")
+parser.add_argument("--max-drop", type=float, default=0.02, help="Largest allowed AP50/recall drop per class")
+parser.add_argument("--imgsz", type=int, default=640, help="Model input size")
+parser.add_argument("--output", default=None, help="INT8 model path, defaults to <model>_int8.onnx next to the .pt")
+args = parser.parse_args()
+
+
+def latency(values):
+    return {"mean_ms": float(values.mean()), "p95_ms": float(np.percentile(values, 95))}
+
+
+def main():
+    classes = args.classes.split(",")
+    output = args.output or artifact_path(args.path, 'onnx', '_int8')
+
+    paths = list_images(args.calib_dir)
+    if not paths:
+        print(f"No calibration images found in {args.calib_dir}")
+        sys.exit(1)
+    if len(paths) < 2:
+        print(f"Need at least 2 images in {args.calib_dir}, one to calibrate and one held out to evaluate")
+        sys.exit(1)
+    random.Random(0).shuffle(paths)
+    # evaluation never sees a calibration image; short folders give up to a third to evaluation
+    eval_size = min(args.eval_size, max(len(paths) - args.calib_size, len(paths) // 3, 1))
+    eval_paths = paths[:eval_size]
+    calib_paths = paths[eval_size:eval_size + args.calib_size]
+    print(f"Calibrating on {len(calib_paths)} images, evaluating on {len(eval_paths)}")
+
+    fp32_path = export_model(args.path, 'onnx', args.imgsz)
+    candidate = output + '.tmp.onnx'
+    quantize_onnx(fp32_path, candidate, calib_paths, args.imgsz)
+
+    fp32 = load_model(fp32_path, 'onnx')
+    int8 = load_model(candidate, 'onnx')
+    images = [image for image in (cv2.imread(path) for path in eval_paths) if image is not None]
+
+    # accuracy: fp32 at the serving threshold is the reference, int8 low so AP sees its whole curve
+    ref_boxes, _ = predict_boxes(fp32, images, args.imgsz, conf=0.25)
+    int8_boxes, _ = predict_boxes(int8, images, args.imgsz, conf=0.001)
+    # latency in a pass of its own, both at the same conf so NMS costs the same
+    _, fp32_latency = predict_boxes(fp32, images, args.imgsz, conf=0.25)
+    _, int8_latency = predict_boxes(int8, images, args.imgsz, conf=0.25)
+    report = {
+        "model": args.path,
+        "output": output,
+        "calibration_images": len(calib_paths),
+        "latency": {"fp32": latency(fp32_latency), "int8": latency(int8_latency)},
+        "speedup": float(fp32_latency.mean() / int8_latency.mean()),
+    }
+
+    if args.data:
+        before = labeled_metrics(fp32, args.data, args.imgsz, classes)
+        after = labeled_metrics(int8, args.data, args.imgsz, classes)
+        report["accuracy_source"] = args.data
+    else:
+        # without labels the fp32 predictions are the reference, so fp32 scores 1.0
+        after = agreement(ref_boxes, int8_boxes, fp32.names, classes)
+        before = {name: {"ap50": 1.0, "recall": 1.0} for name in after}
+        report["accuracy_source"] = "fp32 predictions"
+
+    deltas = {}
+    failed = []
+    # requested classes the model does not have are never compared
+    unchecked = [f"{name} (not in model)" for name in classes if name not in after]
+    checked = 0
+    for name in after:
+        deltas[name] = {}
+        for metric in ("ap50", "map50_95", "recall"):
+            if metric in after[name] and metric in before.get(name, {}):
+                delta = after[name][metric] - before[name][metric]
+                if np.isnan(delta):
+                    # no instances of the class in the evaluation set, nothing to compare
+                    deltas[name][metric] = None
+                    if metric != "map50_95":
+                        unchecked.append(f"{name} {metric}")
+                    continue
+                deltas[name][metric] = delta
+                if metric != "map50_95":
+                    checked += 1
+                    if delta < -args.max_drop:
+                        failed.append(f"{name} {metric} {delta:+.3f}")
+    report.update({"fp32": before, "int8": after, "delta": deltas, "max_drop": args.max_drop,
+                   "unchecked": unchecked, "passed": checked > 0 and not failed})
+    print(json.dumps(report, indent=4))
+    if unchecked:
+        print(f"Not checked: {', '.join(unchecked)}")
+
+    if not checked:
+        os.remove(candidate)
+        print(f"Refusing to write {output}, none of {args.classes} could be checked")
+        sys.exit(1)
+    if failed:
+        os.remove(candidate)
+        print(f"Refusing to write {output}, accuracy drop above {args.max_drop}: {', '.join(failed)}")
+        sys.exit(1)
+    shutil.move(candidate, output)
+    with open(os.path.splitext(output)[0] + '.report.json', 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Wrote {output}, load it with --backend onnx --path {output}")
+
+
+if __name__ == '__main__':
+    main()